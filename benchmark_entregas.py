@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Para uso único de los proyectos de Solidaridad en Marcha o
+# procesos de aprendizaje autorizados por el mismo ente
+#
+# Creador: Rodolfo Piedra Camacho
+# Contacto: fofo.piedra@gmail.com
+#
+
+"""
+Benchmark de las etapas de distribuidor_entregas con datos sintéticos
+
+El script genera encuestas .csv y archivos de censos .xlsx que respetan el
+formato documentado en distribuidor_entregas (separadores "x", break "yy",
+hojas DATA_DELICADA y CRISIS) y mide cada etapa del proceso:
+ - conv_to_xlsx:   Conversión de la encuesta .csv a .xlsx
+ - data_loader:    Lectura de la encuesta
+ - censos_loader:  Búsqueda de censos libres
+ - carga_libro:    Carga del libro de censos con permisos de escritura
+ - censo_spread:   Asignación de dueños (sin contar el guardado)
+ - guardado:       Escritura final del archivo de resultados
+
+Por cada etapa se reporta el tiempo en segundos y el pico de memoria en MB
+(medido con tracemalloc). El resultado se imprime en formato .json
+
+Ejemplo:
+    python3 benchmark_entregas.py --cajas 1000 10000 --centros 5 \\
+        --hojas-por-centro 3 --salida benchmark.json
+"""
+###############################################################################
+#                                  IMPORTS                                    #
+###############################################################################
+import argparse
+import csv
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import openpyxl
+
+import distribuidor_entregas as de
+
+###############################################################################
+#                                  GLOBAL                                    #
+###############################################################################
+# Variable de Log para documentar errores de ejecución
+log = logging.getLogger(__name__)
+
+# Cantidad de filas de cada censo, incluyendo la fila del separador
+filas_por_censo = 7
+
+# Margen de censos libres sobre la cantidad de cajas solicitadas. Con 1.0 la
+# capacidad total es igual a la demanda total
+factor_capacidad = 1.1
+
+
+###############################################################################
+#                             GENERADORES                                     #
+###############################################################################
+# Centros de Acopio Sintéticos
+# ------------------------------------------------------------------------------
+def generar_centros(centros, hojas_por_centro):
+    """
+    Genera la relación de centros de acopio y hojas de censos
+
+    :param centros:          Cantidad de centros de acopio
+    :param hojas_por_centro: Cantidad de hojas de censos por centro
+
+    :return: Diccionario con el formato de dict_centros_de_acopio
+    """
+    return {"Centro {}".format(c + 1):
+            {"C{}H{}".format(c + 1, h + 1): []
+             for h in range(hojas_por_centro)}
+            for c in range(centros)}
+
+
+# Encuesta Sintética
+# ------------------------------------------------------------------------------
+def generar_encuesta(archivo, cajas, centros_de_acopio, semilla=0):
+    """
+    Genera una encuesta .csv con el formato exportado por el formulario
+
+    :param archivo:           Nombre del archivo .csv a generar
+    :param cajas:             Cantidad total de cajas solicitadas
+    :param centros_de_acopio: Lista con los nombres de los centros de acopio
+    :param semilla:           Semilla de números aleatorios
+
+    :return: Cantidad de donadores generados
+    """
+    aleatorio = random.Random(semilla)
+    columnas = [de.columna_nombre, de.columna_telefono, de.columna_cant_cajas,
+                de.columna_c_acopio_1, de.columna_c_acopio_2]
+    ancho = max(de.indice_columna(columna) for columna in columnas) + 1
+
+    donadores = 0
+    with open(archivo, 'w', newline='', encoding='utf-8') as arch_csv:
+        escritor = csv.writer(arch_csv, quoting=csv.QUOTE_ALL)
+        encabezado = ["Columna {}".format(i + 1) for i in range(ancho)]
+        escritor.writerow(encabezado)
+
+        while cajas > 0:
+            cant_cajas = min(cajas, aleatorio.choice([1, 1, 1, 2, 3, 5]))
+            cajas -= cant_cajas
+            donadores += 1
+
+            registro = ["2018/10/18 9:55:21 p. m. GMT-5"] * ancho
+            registro[de.indice_columna(de.columna_nombre)] = \
+                "Donador {}".format(donadores)
+            registro[de.indice_columna(de.columna_telefono)] = \
+                str(80000000 + donadores)
+            registro[de.indice_columna(de.columna_cant_cajas)] = \
+                str(cant_cajas)
+            registro[de.indice_columna(de.columna_c_acopio_1)] = \
+                aleatorio.choice(centros_de_acopio)
+            registro[de.indice_columna(de.columna_c_acopio_2)] = \
+                aleatorio.choice(centros_de_acopio)
+            escritor.writerow(registro)
+
+    return donadores
+
+
+# Libro de Censos Sintético
+# ------------------------------------------------------------------------------
+def generar_censos(archivo, dict_centros, censos_por_hoja):
+    """
+    Genera un libro de censos con una hoja por censo de dict_centros, más las
+    hojas hoja_error y hoja_data_delicada con el contador en 0
+
+    :param archivo:         Nombre del archivo .xlsx a generar
+    :param dict_centros:    Diccionario con el formato de
+                            dict_centros_de_acopio
+    :param censos_por_hoja: Cantidad de censos sin dueño de cada hoja
+    """
+    wb = openpyxl.Workbook(write_only=True)
+    columna = de.indice_columna(de.columna_dueño)
+
+    for censos in dict_centros.values():
+        for hoja in censos:
+            ws = wb.create_sheet(hoja)
+            for censo in range(censos_por_hoja):
+                for fila in range(filas_por_censo):
+                    valores = [None] * (columna + 4)
+                    if fila == 0:
+                        valores[columna] = de.separador_censos
+                    elif fila == 1:
+                        valores[columna + 1] = "# Censo"
+                    else:
+                        valores[columna + 1] = "{} {}".format(hoja, censo + 1)
+                        valores[columna + 2] = "Familiar {}".format(fila - 1)
+                        valores[columna + 3] = 30 - fila
+                    ws.append(valores)
+            ws.append([None] * columna + [de.break_lectura_censos])
+
+    ws = wb.create_sheet(de.hoja_error)
+    ws.append(["Errores"])
+
+    ws = wb.create_sheet(de.hoja_data_delicada)
+    filas = [int(celda[1:]) for celda in de.lista_celdas]
+    for fila in range(1, max(filas) + 1):
+        ws.append([0] if fila in filas else [None])
+
+    wb.save(archivo)
+
+
+###############################################################################
+#                                 MEDICIÓN                                    #
+###############################################################################
+class Medicion():
+    """
+    Acumula el tiempo y el pico de memoria de cada etapa
+
+    :param memoria: Si es True se mide el pico de memoria con tracemalloc
+    :param etapas:  Diccionario {etapa: {"segundos": s, "memoria_mb": mb}}
+    """
+    def __init__(self, memoria=True):
+        self.memoria = memoria
+        self.etapas = {}
+
+    @contextmanager
+    def etapa(self, nombre):
+        if self.memoria:
+            tracemalloc.start()
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            resultado = {"segundos": round(time.perf_counter() - inicio, 6)}
+            if self.memoria:
+                resultado["memoria_mb"] = round(
+                    tracemalloc.get_traced_memory()[1] / 2 ** 20, 3)
+                tracemalloc.stop()
+            self.etapas[nombre] = resultado
+
+
+###############################################################################
+#                                 BENCHMARK                                   #
+###############################################################################
+def configurar(directorio, dict_centros):
+    """
+    Apunta las variables globales de distribuidor_entregas a los archivos
+    sintéticos de directorio
+    """
+    de.resultados_filename = os.path.join(directorio, "censos.xlsx")
+    de.censos_filename = de.resultados_filename
+    de.csv_orig_filename = os.path.join(directorio, "encuesta.csv")
+    de.encuesta_filename = os.path.join(directorio, "encuesta.xlsx")
+    de.conversion_filename = os.path.join(directorio,
+                                          "encuesta_conversion.json")
+    de.cursor_filename = os.path.join(directorio, "encuesta_cursor.json")
+    de.indice_censos_filename = os.path.join(directorio, "indice_censos.json")
+    de.cambios_filename = os.path.join(directorio, "cambios_censos.jsonl")
+    de.diario_filename = os.path.join(directorio, "diario_asignaciones.jsonl")
+    de.indice_donadores_filename = os.path.join(directorio,
+                                                "indice_donadores.json")
+    de.encuesta_encoding = "utf-8"
+    de.dict_centros_de_acopio = dict_centros
+    de.dict_centros_de_acopio_full_status = dict.fromkeys(dict_centros, False)
+
+
+def ejecutar_caso(directorio, cajas, centros, hojas_por_centro, memoria,
+                  semilla):
+    """
+    Genera los archivos de un caso y mide cada etapa de la distribución
+
+    :return: Diccionario con la descripción del caso y sus mediciones
+    """
+    dict_centros = generar_centros(centros, hojas_por_centro)
+    hojas = centros * hojas_por_centro
+    censos_por_hoja = max(1, int(cajas * factor_capacidad / hojas))
+
+    configurar(directorio, dict_centros)
+    donadores = generar_encuesta(de.csv_orig_filename, cajas,
+                                 list(dict_centros), semilla)
+    generar_censos(de.censos_filename, dict_centros, censos_por_hoja)
+
+    medicion = Medicion(memoria)
+
+    # El guardado se mide aparte, posterior a censo_spread
+    class SesionMedida(de.SesionLibros):
+        def guardar(self):
+            pass
+
+    with SesionMedida() as sesion:
+        if de.modo_ingesta == "stream":
+            with medicion.etapa("data_loader"):
+                encuesta = list(de.EncuestaStream(de.csv_orig_filename, 0,
+                                                  sesion))
+        elif de.modo_ingesta == "columnas":
+            with medicion.etapa("data_loader"):
+                encuesta = de.leer_encuesta_columnas(de.csv_orig_filename, 0,
+                                                     sesion)
+        else:
+            with medicion.etapa("conv_to_xlsx"):
+                de.conv_to_xlsx(de.csv_orig_filename)
+            with medicion.etapa("data_loader"):
+                encuesta = de.data_loader(0, sesion)
+
+        with medicion.etapa("censos_loader"):
+            data_censos = de.censos_loader(sesion)
+
+        with medicion.etapa("carga_libro"):
+            sesion.wb
+
+        with medicion.etapa("censo_spread"):
+            de.censo_spread(encuesta, data_censos, sesion)
+
+        with medicion.etapa("guardado"):
+            de.SesionLibros.guardar(sesion)
+
+    return {"cajas": cajas,
+            "donadores": donadores,
+            "centros": centros,
+            "hojas": hojas,
+            "censos_libres": censos_por_hoja * hojas,
+            "modo_ingesta": de.modo_ingesta,
+            "motor_lectura": de.motor_lectura,
+            "motor_asignacion": de.motor_asignacion,
+            "procesos_lectura_censos": de.procesos_lectura_censos,
+            "tamaño_censos_mb": round(
+                os.path.getsize(de.censos_filename) / 2 ** 20, 3),
+            "etapas": medicion.etapas}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark de distribuidor_entregas con datos sintéticos")
+    parser.add_argument("--cajas", type=int, nargs="+", default=[1000],
+                        help="Cantidades de cajas a medir")
+    parser.add_argument("--centros", type=int, default=3,
+                        help="Cantidad de centros de acopio")
+    parser.add_argument("--hojas-por-centro", type=int, default=2,
+                        help="Cantidad de hojas de censos por centro")
+    parser.add_argument("--modo-ingesta",
+                        choices=["xlsx", "stream", "columnas"],
+                        default=de.modo_ingesta)
+    parser.add_argument("--motor", choices=["greedy", "flujo"],
+                        default=de.motor_asignacion)
+    parser.add_argument("--motor-lectura",
+                        choices=["auto", "pyarrow", "pandas", "stdlib"],
+                        default=de.motor_lectura)
+    parser.add_argument("--procesos", type=int,
+                        default=de.procesos_lectura_censos,
+                        help="Procesos para la lectura de censos")
+    parser.add_argument("--sin-memoria", action="store_true",
+                        help="No medir memoria (tracemalloc hace más lenta "
+                             "la ejecución)")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--directorio",
+                        help="Directorio para los archivos generados, por "
+                             "defecto uno temporal")
+    parser.add_argument("--salida", help="Archivo .json de resultados, por "
+                                         "defecto se imprime en pantalla")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    de.modo_ingesta = args.modo_ingesta
+    de.motor_asignacion = args.motor
+    de.motor_lectura = args.motor_lectura
+    de.procesos_lectura_censos = args.procesos
+    de.usar_indice_censos = False
+
+    resultados = []
+    for cajas in args.cajas:
+        with tempfile.TemporaryDirectory() as temporal:
+            directorio = args.directorio or temporal
+            log.warning("Caso de {} cajas en {}".format(cajas, directorio))
+            resultados.append(ejecutar_caso(
+                directorio, cajas, args.centros, args.hojas_por_centro,
+                not args.sin_memoria, args.semilla))
+
+    reporte = json.dumps(resultados, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as archivo:
+            archivo.write(reporte)
+    else:
+        print(reporte)
+
+
+if __name__ == '__main__':
+    main()
@@ -12,10 +12,16 @@
 Script para distribución de Censos con sus Donantes Respectivos
 
 El script cumple las siguientes funciones
- - Traduce una encuesta en formato tipo .csv a formato .xlsx
+ - Traduce una encuesta en formato tipo .csv a formato .xlsx, o la lee
+   directamente desde la última fila procesada (modo_ingesta "stream")
  - Distribuye las solicitudes de la encuesta con los respectivos censos
+ - Ejecuta a la vez varias campañas (familias de archivos con sus propias
+   variables globales) con la opción --campañas
+ - Simula en memoria escenarios de centros de acopio, capacidades y orden de
+   los dueños (clase Simulacion u opción --simular)
  - Reconoce casos de error y los documenta en un tab llamado "Crisis". Errores:
    - No exiten censos que distribuir
+   - Solicitudes repetidas (mismo nombre y telefono normalizados)
 
 Detalles Importantes y Cuidados
 ###############################
@@ -51,7 +57,8 @@ formato:
 
 LIMITACIONES
 ###############################
-1) La información en la hoja de encuestas no es corroborada de ninguna forma
+1) La información en la hoja de encuestas no es corroborada de ninguna forma,
+   salvo la detección de solicitudes repetidas (detectar_repetidos)
 2) No existe método para borrar entradas
 3) Las variables globales solo se pueden modificar previo a usar el script por
    primera vez en una familia de archivos. Si se modifican los valores y se
@@ -60,10 +67,30 @@ LIMITACIONES
 ###############################################################################
 #                                  IMPORTS                                    #
 ###############################################################################
+import argparse
+import cProfile
 import csv
-import openpyxl
+import hashlib
+import heapq
+import io
+import json
+import locale
+import os
 import logging
+import random
+import re
+import shutil
+import time
+import unicodedata
+import zipfile
+from collections import deque
+from contextlib import contextmanager
 from copy import deepcopy
+from itertools import islice
+from xml.etree import ElementTree
+
+# openpyxl y concurrent.futures se importan dentro de las funciones que los
+# usan. Una ejecución sin registros nuevos termina sin importarlos
 
 ###############################################################################
 #                                  GLOBAL                                    #
@@ -84,6 +111,42 @@ csv_orig_filename = "Cajas de la Amor.csv"
 # Nombre del archivo de encuestas post conversión csv->xlsx
 encuesta_filename = "encuesta.xlsx"
 
+# Nombre del archivo con el estado de la última conversión csv->xlsx (filas
+# convertidas, posición en bytes y checksum del .csv convertido). Permite a
+# conv_to_xlsx agregar solo los registros nuevos a encuesta_filename
+conversion_filename = "encuesta_conversion.json"
+
+# Nombre del archivo con el índice de censos libres de cada hoja. Permite a
+# censos_loader releer solo las hojas que cambiaron desde la última ejecución
+indice_censos_filename = "indice_censos.json"
+
+# Nombre del archivo de cambios pendientes del libro de censos, usado con
+# modo_escritura "cambios" y "hojas"
+cambios_filename = "cambios_censos.jsonl"
+
+# Nombre del archivo diario de asignaciones. Registra cada caja distribuida
+# por censo_spread antes de guardar el libro, permite reanudar una ejecución
+# interrumpida sin repetir las asignaciones
+diario_filename = "diario_asignaciones.jsonl"
+
+# Nombre del archivo con el índice de donadores registrados (teléfono y
+# nombre normalizados). Permite detectar solicitudes repetidas sin recorrer
+# las hojas de censos
+indice_donadores_filename = "indice_donadores.json"
+
+# Nombre de la base de datos SQLite con el estado de la distribución, usada
+# con modo_estado "sqlite"
+estado_filename = "estado_entregas.sqlite"
+
+# Nombre del archivo con el tamaño y fecha de modificación de la encuesta y
+# los libros al final de la última ejecución. Si ninguno cambió, main termina
+# sin cargar los libros
+sello_filename = "sello_ejecucion.json"
+
+# Nombre del archivo donde se guarda el cursor de lectura directa del .csv
+# (última fila procesada y su posición en bytes dentro del archivo)
+cursor_filename = "encuesta_cursor.json"
+
 # Nombre de la hoja en el archivo de encuestas post conversión csv->xlsx
 encuesta_sheet_name = "DATA"
 
@@ -147,6 +210,129 @@ break_lectura_censos = "yy"
 # escribira el nombre y numero de teléfono del dueño
 columna_dueño = "A"
 
+# Política de Selección de Censos
+# "orden":      Los censos de cada centro de acopio se llenan uno tras otro en
+#               el orden de dict_centros_de_acopio
+# "balanceado": Cada caja se asigna al censo de su centro de acopio con mayor
+#               prioridad (filas libres multiplicadas por su peso en
+#               pesos_censos), manteniendo pareja la carga entre censos
+politica_censos = "orden"
+
+# Pesos de los censos para la política "balanceado", {censo: peso}. Un censo
+# con peso 2 recibe cajas como si tuviera el doble de filas libres. Los censos
+# que no aparecen tienen peso 1
+pesos_censos = {}
+
+# Modo de Ingesta de la Encuesta
+# ------------------------------------------------------------------------------
+# "xlsx":   Convierte el .csv a encuesta_filename y lo lee con data_loader
+# "stream": Lee directamente el .csv desde la última fila procesada, usando la
+#           posición en bytes guardada en cursor_filename. No genera ni guarda
+#           el archivo encuesta_filename
+# "columnas": Lee el .csv completo en columnas con motor_lectura, valida las
+#             cantidades de cajas en bloque y documenta en hoja_error las
+#             filas con una cantidad inválida o sin un centro de acopio de
+#             dict_centros_de_acopio
+# En todos los modos las líneas vacías del .csv se cuentan como filas leídas
+# pero no generan donadores
+modo_ingesta = "xlsx"
+
+# Motor de lectura del modo de ingesta "columnas"
+# "auto":    Usa pyarrow o pandas si alguno está instalado, si no "stdlib"
+# "pyarrow": pyarrow.csv y pyarrow.compute
+# "pandas":  pandas.read_csv
+# "stdlib":  Módulo csv de la librería estándar
+# Si el motor elegido no está instalado o no logra leer el archivo (por
+# ejemplo filas con menos columnas) se usa el siguiente, hasta "stdlib"
+motor_lectura = "auto"
+
+# Codificación del archivo .csv de encuestas. None usa la codificación por
+# defecto del sistema
+encuesta_encoding = None
+
+# Uso del índice de censos libres (indice_censos_filename). Si es False
+# censos_loader siempre lee todas las hojas de censos
+usar_indice_censos = True
+
+# Cantidad de procesos usados por censos_loader para leer las hojas de censos
+# en paralelo. Con 1 las hojas se leen una tras otra en el proceso principal
+procesos_lectura_censos = 1
+
+# Modo de Estado de la Distribución
+# "xlsx":   Los censos libres, dueños y errores se leen y escriben en el libro
+#           de censos
+# "sqlite": Se usan tablas indexadas en estado_filename. La base se importa
+#           del libro de censos en la primera ejecución y el libro
+#           resultados_filename solo se genera con la opción --exportar
+modo_estado = "xlsx"
+
+# Modo de Escritura de Resultados
+# "xlsx":    Al final de censo_spread se guarda el libro completo en
+#            resultados_filename
+# "cambios": Solo se agregan las celdas modificadas a cambios_filename. Los
+#            cambios se fusionan al libro con la opción --fusionar
+# "hojas":   Memoria acotada. El libro de censos nunca se carga completo:
+#            las hojas se leen en modo solo lectura y al guardar
+#            resultados_filename se reescribe una hoja a la vez, copiando
+#            sin cambios las hojas sin celdas modificadas
+modo_escritura = "xlsx"
+
+# Detección de Donadores Repetidos
+# Si es True, una solicitud igual a otra de un donador que ya recibió cajas
+# (mismo teléfono y nombre normalizados, misma cantidad de cajas y mismos
+# centros de acopio) no recibe cajas y se documenta en hoja_error con el
+# código error_repetido. Las solicitudes con otra cantidad de cajas u otros
+# centros se asignan normalmente
+detectar_repetidos = False
+
+# Cantidad de dígitos finales del teléfono que se comparan. Descarta códigos
+# de país como +506
+digitos_telefono = 8
+
+# Diario de Asignaciones y Lotes
+# Cantidad de cajas que se acumulan en memoria antes de escribirlas en
+# diario_filename
+cajas_por_escritura_diario = 100
+
+# Cantidad máxima de donadores distribuidos entre cada guardado del libro de
+# censos. None distribuye todos los donadores nuevos con un único guardado
+donadores_por_lote = None
+
+# Modo de Vigilancia (--vigilar)
+# Segundos entre cada revisión de registros nuevos en csv_orig_filename
+intervalo_sondeo = 0.5
+
+# Segundos mínimos entre cada guardado del libro de censos. Las asignaciones
+# se mantienen en memoria y en diario_filename entre guardados
+intervalo_guardado = 60
+
+# Motor de Asignación de censo_spread
+# "greedy": Asigna a cada dueño en el orden de la encuesta, primero en su
+#           primera opción, luego en la segunda y si no hay espacio en CRISIS
+# "flujo":  Resuelve todo el lote a la vez como un flujo de costo mínimo.
+#           Maximiza la cantidad de cajas asignadas y luego la cantidad
+#           asignada a la primera opción
+# No existe un motor que reparta cada centro de acopio en su propio proceso.
+# El libro de censos solo se puede escribir desde un proceso y "greedy" ya
+# recorre cada dueño una única vez: con 100000 cajas en 30 centros, repartir
+# la primera opción por centro en procesos tardó 0.25 s (1 proceso) y 0.30 s
+# (4 procesos) contra 0.16 s de "greedy"
+motor_asignacion = "greedy"
+
+# Varias Campañas (--campañas)
+# Cantidad de procesos usados para ejecutar campañas a la vez. Cada campaña
+# corre en un proceso con sus propias variables globales. None usa un proceso
+# por núcleo, con 1 las campañas se ejecutan una tras otra
+procesos_campañas = None
+
+# Nombre del archivo con el resumen combinado de métricas y crisis de todas
+# las campañas
+resumen_campañas_filename = "resumen_campañas.json"
+
+# Simulación de Escenarios (--simular)
+# Nombre del archivo con los resultados de cada escenario simulado
+resultados_simulacion_filename = "resultados_simulacion.json"
+
 # Localización de Datos en .csv y .xlsx de Encuesta
 # A su vez se usa como las columnas donde se almacena la información de Error
 # ------------------------------------------------------------------------------
@@ -177,11 +363,31 @@ error_repetición = 0
 # Fallo en distribución
 error_distribución = 1
 
+# Donador repetido
+error_repetido = 2
+
+# Fila inválida en la encuesta
+error_formato = 3
+
 # Mensajes de Error. Lista indexada por los codigo de error
 msj_error = ["No se encontro espacio en el Primer Sector de Distribución y el"
              " Segundo era repetido",
              "No se logro asignar un censo al interesado porque ambos sectores"
-             " estan completos"]
+             " estan completos",
+             "Solicitud repetida, el donador ya recibió cajas con el mismo "
+             "nombre, telefono, cantidad de cajas y centros de acopio",
+             "La cantidad de cajas de la encuesta no es un número entero o el"
+             " centro de acopio no existe"]
+
+# Variables de Configuración
+# ------------------------------------------------------------------------------
+# Nombres de las variables globales de esta sección, las únicas que una
+# campaña (--campañas) puede reemplazar. No incluye módulos, loggers ni
+# funciones
+variables_configuracion = frozenset(
+    llave for llave, valor in list(globals().items())
+    if not llave.startswith("_") and
+    isinstance(valor, (str, int, float, list, dict, tuple, type(None))))
 
 
 ###############################################################################
@@ -189,7 +395,8 @@ msj_error = ["No se encontro espacio en el Primer Sector de Distribución y el"
 ###############################################################################
 class CensoOwner():
     """
-    Contiene la información de un encargado de un único censo
+    Contiene la información de un encargado de censos. Un mismo encargado
+    puede recibir varias cajas, cada una corresponde a un censo
     :param nombre:             Nombre del Dueño
     :param telefono:           Número de Teléfono del Dueño
     :param c_acopio_1:         Nombre de la primera opción para centro de
@@ -200,8 +407,19 @@ class CensoOwner():
                                repetido
     :param codigo_error:       Almacena el número de error en caso de ser
                                necesario
+    :param cant_cajas:         Cantidad de cajas tal como aparece en la
+                               encuesta
+    :param cajas_totales:      Cantidad de cajas (censos) a asignar
+    :param cajas_error:        Cantidad de cajas que no se lograron asignar
+    :param fila:               Fila de la encuesta de donde proviene el dueño
     """
-    def __init__(self, nombre, telefono, c_ac_1, c_ac_2, cant_cajas):
+    __slots__ = ("nombre", "telefono", "c_acopio_1", "c_acopio_2",
+                 "c_acopio_repetido", "codigo_error", "cant_cajas",
+                 "cajas_totales", "cajas_error", "fila")
+
+    def __init__(self, nombre, telefono, c_ac_1, c_ac_2, cant_cajas,
+                 cajas_totales=1, fila=None):
+        self.fila = fila
         self.nombre = nombre
         self.telefono = telefono
         self.c_acopio_1 = c_ac_1
@@ -209,6 +427,8 @@ class CensoOwner():
         self.c_acopio_repetido = (c_ac_1 == c_ac_2)
         self.codigo_error = None
         self.cant_cajas = cant_cajas
+        self.cajas_totales = cajas_totales
+        self.cajas_error = 0
 
     # Método para propositos de debugging
     def print_data(self):
@@ -218,22 +438,1841 @@ class CensoOwner():
                 self.c_acopio_repetido, self.codigo_error))
 
 
+class EncuestaStream():
+    """
+    Lectura directa del archivo de encuestas .csv. Al iterar genera un
+    CensoOwner por cada registro posterior a fila_previa, sin
+    construir ni guardar el archivo .xlsx intermedio
+
+    Si el cursor guardado en cursor_filename corresponde a fila_previa la
+    lectura salta directamente a la posición en bytes del primer registro sin
+    procesar. En caso contrario se lee el archivo desde el inicio descartando
+    los registros ya procesados
+
+    :param arch_csv:    Nombre del archivo de encuestas con extención .csv
+    :param fila_previa: Contiene el valor de la última fila que fue analizada
+    :param sesion:      SesionLibros opcional donde se registra la cantidad
+                        de filas leídas
+    :param fila:        Última fila leída del archivo (se actualiza al iterar)
+    :param offset:      Posición en bytes posterior a la última fila leída.
+                        Al iterar de nuevo la lectura continúa desde aquí
+    :param completas:   Si es True solo se leen líneas terminadas en salto de
+                        línea, para archivos que aún se están escribiendo
+    """
+    def __init__(self, arch_csv, fila_previa, sesion=None, completas=False):
+        self.arch_csv = arch_csv
+        self.fila_previa = fila_previa
+        self.fila = fila_previa
+        self.offset = None
+        self.sesion = sesion
+        self.completas = completas
+        if sesion is not None:
+            sesion.stream = self
+
+    def _cursor_valido(self, archivo):
+        """
+        Verifica que el cursor guardado corresponda a fila_previa y al
+        contenido actual del archivo
+
+        :param archivo: Archivo .csv abierto en modo binario
+
+        :return: Posición en bytes del primer registro sin procesar o None si
+                 el cursor no es utilizable
+        """
+        try:
+            with open(cursor_filename) as arch_cursor:
+                cursor = json.load(arch_cursor)
+        except (OSError, ValueError):
+            return None
+
+        if cursor.get("archivo") != self.arch_csv or \
+           cursor.get("fila") != self.fila_previa:
+            return None
+
+        # Los últimos bytes antes del cursor deben coincidir con los guardados
+        # para detectar archivos reescritos o editados
+        offset = cursor.get("offset", 0)
+        cola = bytes.fromhex(cursor.get("cola", ""))
+        archivo.seek(max(offset - len(cola), 0))
+        if archivo.read(len(cola)) != cola:
+            log.info("Cursor {} no coincide con {}, se leera el archivo "
+                     "completo".format(cursor_filename, self.arch_csv))
+            return None
+
+        return offset
+
+    def _lineas(self, archivo, encoding):
+        """
+        Generador de líneas del archivo que mantiene actualizado self.offset
+        """
+        while True:
+            linea = archivo.readline()
+            if not linea or (self.completas and not linea.endswith(b'\n')):
+                return
+            self.offset += len(linea)
+            yield linea.decode(encoding)
+
+    def hay_nuevos(self):
+        """
+        Chequeo rápido de registros nuevos. Solo descarta la lectura si el
+        cursor es válido y apunta al final del archivo
+
+        :return: False si con certeza no hay registros nuevos
+        """
+        if self.offset is not None:
+            return self.offset < os.path.getsize(self.arch_csv)
+
+        with open(self.arch_csv, 'rb') as archivo:
+            offset = self._cursor_valido(archivo)
+        return offset is None or offset < os.path.getsize(self.arch_csv)
+
+    def guardar_cursor(self):
+        """
+        Guarda la fila y posición en bytes alcanzadas en cursor_filename.
+        Debe llamarse solo después de guardar la distribución de estas filas
+        """
+        with open(self.arch_csv, 'rb') as archivo:
+            archivo.seek(max(self.offset - 32, 0))
+            cola = archivo.read(self.offset - archivo.tell())
+
+        guardar_json(cursor_filename, {"archivo": self.arch_csv,
+                                       "fila": self.fila,
+                                       "offset": self.offset,
+                                       "cola": cola.hex()})
+
+    def __iter__(self):
+        encoding = encuesta_encoding or locale.getpreferredencoding(False)
+
+        # Abrir el archivo
+        try:
+            archivo = open(self.arch_csv, 'rb')
+        except Exception:
+            log.error("Archivo de encuentas {} no se encuentra".format(
+                self.arch_csv))
+            raise
+
+        with archivo:
+            if self.offset is not None:
+                # Continuación de una lectura previa
+                fila, offset = self.fila, self.offset
+            else:
+                offset = self._cursor_valido(archivo)
+                if offset is None:
+                    fila, offset = 0, 0
+                else:
+                    fila = self.fila_previa
+                    log.info("Lectura de {} desde la fila {} (byte "
+                             "{})".format(self.arch_csv, fila, offset))
+
+            archivo.seek(offset)
+            self.offset = offset
+
+            # Si el último registro leído no terminaba en salto de línea, el
+            # salto agregado al anexar nuevos registros no es un registro
+            if offset > 0:
+                archivo.seek(offset - 1)
+                if archivo.read(1) != b'\n':
+                    for salto in (b'\r\n', b'\n'):
+                        if archivo.read(len(salto)) == salto:
+                            self.offset += len(salto)
+                            break
+                        archivo.seek(self.offset)
+
+            # Demarca el signo que usa el .csv para separar su información
+            csv.register_dialect('colons', delimiter=',')
+            lectura = csv.reader(self._lineas(archivo, encoding),
+                                 dialect='colons')
+
+            for registro in lectura:
+                fila += 1
+                self.fila = fila
+                if self.sesion is not None:
+                    self.sesion.filas_encuesta = fila
+
+                # La primera fila contiene los headers del .csv
+                if fila <= self.fila_previa or fila == 1 or not registro:
+                    continue
+
+                # Celdas vacias se tratan igual que en el archivo .xlsx
+                def campo(columna):
+                    indice = indice_columna(columna)
+                    if indice < len(registro) and registro[indice] != "":
+                        return registro[indice]
+                    return None
+
+                # Un mismo donador podria entregar más de una caja
+                cant_cajas = campo(columna_cant_cajas)
+                cajas_totales = int(cant_cajas)
+                if cajas_totales <= 0:
+                    continue
+
+                yield CensoOwner(nombre=campo(columna_nombre),
+                                 telefono=campo(columna_telefono),
+                                 c_ac_1=campo(columna_c_acopio_1),
+                                 c_ac_2=campo(columna_c_acopio_2),
+                                 cant_cajas=cant_cajas,
+                                 cajas_totales=cajas_totales,
+                                 fila=fila)
+
+
+class Metricas():
+    """
+    Métricas de una ejecución del script: tiempo de cada etapa y contadores
+    de filas leídas, censos libres, asignaciones y crisis
+
+    :param etapas:     Diccionario {etapa: segundos}. Las etapas pueden estar
+                       anidadas (censo_spread incluye carga_libro, asignacion
+                       y guardado)
+    :param contadores: Diccionario {contador: valor} o
+                       {contador: {clave: valor}} para contadores por hoja o
+                       por código de error
+    """
+    def __init__(self):
+        self.etapas = {}
+        self.contadores = {}
+
+    @contextmanager
+    def etapa(self, nombre):
+        """
+        Mide el tiempo de pared de una etapa, acumulando si se repite
+        """
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.etapas[nombre] = self.etapas.get(nombre, 0) + \
+                time.perf_counter() - inicio
+
+    def fijar(self, nombre, valor, clave=None):
+        """
+        Reemplaza el valor de un contador, o de la clave de un contador por
+        clave
+        """
+        if clave is None:
+            self.contadores[nombre] = valor
+        else:
+            self.contadores.setdefault(nombre, {})[str(clave)] = valor
+
+    def sumar(self, nombre, cantidad=1, clave=None):
+        """
+        Suma cantidad a un contador, o a la clave de un contador por clave
+        """
+        if clave is None:
+            self.contadores[nombre] = self.contadores.get(nombre, 0) + cantidad
+        else:
+            contador = self.contadores.setdefault(nombre, {})
+            clave = str(clave)
+            contador[clave] = contador.get(clave, 0) + cantidad
+
+    def reporte(self):
+        """
+        :return: Diccionario serializable a .json con todas las métricas
+        """
+        asignaciones = self.contadores.get("asignaciones", 0)
+        segundos = self.etapas.get("asignacion")
+        return {"etapas": {etapa: round(segundos, 6)
+                           for etapa, segundos in self.etapas.items()},
+                "contadores": self.contadores,
+                "asignaciones_por_segundo":
+                    round(asignaciones / segundos, 3) if segundos else None}
+
+    def guardar(self, nombre):
+        """
+        Guarda el reporte de métricas en un archivo .json
+        """
+        with open(nombre, 'w', encoding='utf-8') as archivo:
+            json.dump(self.reporte(), archivo, indent=2, ensure_ascii=False)
+
+
+# Métricas de la ejecución actual, main las reinicia en cada ejecución
+metricas = Metricas()
+
+
+class RegistroCambios():
+    """
+    Cambios pendientes del libro de censos guardados en un archivo de solo
+    agregado. Cada línea es un lote .json [[hoja, celda, valor], ...] con las
+    celdas escritas por una ejecución. Un lote incompleto por un fallo durante
+    la escritura se descarta completo
+
+    Mientras no se fusionen, los cambios se superponen a los valores del libro
+
+    :param nombre: Nombre del archivo de cambios
+    :param celdas: Diccionario {hoja: {celda: valor}} con todos los cambios
+    :param lote:   Lista de cambios [hoja, celda, valor] sin confirmar
+    """
+    def __init__(self, nombre):
+        self.nombre = nombre
+        self.celdas = {}
+        self.lote = []
+
+        try:
+            archivo = open(self.nombre, 'rb+')
+        except FileNotFoundError:
+            return
+
+        with archivo:
+            completo = 0
+            for linea in archivo:
+                try:
+                    for hoja, celda, valor in json.loads(linea):
+                        self.celdas.setdefault(hoja, {})[celda] = valor
+                except ValueError:
+                    log.warning("Lote incompleto en {} descartado".format(
+                        self.nombre))
+                    break
+                completo += len(linea)
+
+            # Se elimina el lote incompleto para poder seguir agregando
+            archivo.truncate(completo)
+
+    def valor(self, hoja, celda, defecto=None):
+        """
+        :return: Valor pendiente de la celda o defecto si no fue modificada
+        """
+        return self.celdas.get(hoja, {}).get(celda, defecto)
+
+    def max_fila(self, hoja):
+        """
+        :return: Última fila con cambios pendientes en la hoja, 0 si no posee
+        """
+        return max((int(re.sub("[A-Z]", "", celda))
+                    for celda in self.celdas.get(hoja, {})), default=0)
+
+    def escribir(self, hoja, celda, valor):
+        self.lote.append([hoja, celda, valor])
+        self.celdas.setdefault(hoja, {})[celda] = valor
+
+    def confirmar(self):
+        """
+        Agrega el lote actual al final del archivo de cambios
+        """
+        if not self.lote:
+            return
+
+        with open(self.nombre, 'a') as archivo:
+            archivo.write(json.dumps(self.lote) + "\n")
+            archivo.flush()
+            os.fsync(archivo.fileno())
+        self.lote = []
+
+    def aplicar(self, wb):
+        """
+        Escribe todos los cambios pendientes en un libro cargado
+        """
+        for hoja, celdas in self.celdas.items():
+            for celda, valor in celdas.items():
+                wb[hoja][celda] = valor
+
+    def vaciar(self):
+        """
+        Elimina los cambios pendientes, usado cuando ya fueron guardados en
+        el libro de censos
+        """
+        self.celdas = {}
+        self.lote = []
+        if os.path.exists(self.nombre):
+            os.remove(self.nombre)
+
+
+class DiarioAsignaciones():
+    """
+    Diario de las cajas distribuidas desde el último guardado del libro de
+    censos. Cada caja se identifica por su fila de encuesta y su número de
+    caja dentro del dueño. La primera línea del archivo guarda el contador de
+    hoja_data_delicada al iniciar, las siguientes son lotes .json de
+    cajas_por_escritura_diario entradas:
+     - [fila, caja, censo, fila_censo] para una caja asignada
+     - [fila, caja, None, codigo_error] para una caja sin asignar
+
+    Si el libro se guardó después de iniciar el diario el contador ya no
+    coincide y el diario se descarta
+
+    :param nombre:      Nombre del archivo diario
+    :param fila_previa: Contador de hoja_data_delicada del libro actual
+    :param previas:     Diccionario {fila: [entradas]} leído del archivo
+    :param lote:        Lista de entradas sin escribir
+    """
+    def __init__(self, nombre, fila_previa):
+        self.nombre = nombre
+        self.fila_previa = fila_previa
+        self.previas = {}
+        self.lote = []
+        self.iniciado = False
+
+        try:
+            archivo = open(self.nombre, 'rb+')
+        except FileNotFoundError:
+            return
+
+        with archivo:
+            completo = 0
+            for i, linea in enumerate(archivo):
+                try:
+                    datos = json.loads(linea)
+                except ValueError:
+                    break
+                if i == 0 and datos != {"fila_previa": fila_previa}:
+                    log.info("Diario {} corresponde a otra ejecución, se "
+                             "descarta".format(self.nombre))
+                    completo = 0
+                    break
+                for entrada in datos if i > 0 else []:
+                    self.previas.setdefault(entrada[0], []).append(entrada)
+                completo += len(linea)
+
+            # Se elimina el lote incompleto para poder seguir agregando
+            archivo.truncate(completo)
+            self.iniciado = completo > 0
+
+        if self.previas:
+            log.warning("Se reanuda la distribución con {} cajas del diario "
+                        "{}".format(sum(map(len, self.previas.values())),
+                                    self.nombre))
+
+    def tomadas(self):
+        """
+        :return: Conjunto de (censo, fila_censo) asignados en el diario
+        """
+        return {(censo, fila_censo)
+                for entradas in self.previas.values()
+                for fila, caja, censo, fila_censo in entradas
+                if censo is not None}
+
+    def reanudar(self, data_encuesta):
+        """
+        Descuenta de cada dueño las cajas que ya se encuentran en el diario
+
+        :param data_encuesta: Iterable de objetos CensoOwner
+
+        :return: Generador de los mismos objetos CensoOwner
+        """
+        for dueño in data_encuesta:
+            dueño.cajas_totales -= len(self.previas.get(dueño.fila, []))
+            yield dueño
+
+    def registrar(self, fila, caja, censo, valor):
+        """
+        Registra una caja, valor es la fila del censo o el código de error si
+        censo es None
+        """
+        self.lote.append([fila, caja, censo, valor])
+        if len(self.lote) >= cajas_por_escritura_diario:
+            self.escribir()
+
+    def escribir(self):
+        """
+        Agrega el lote actual al final del diario
+        """
+        if not self.lote:
+            return
+
+        with open(self.nombre, 'a') as archivo:
+            if not self.iniciado:
+                archivo.write(json.dumps({"fila_previa": self.fila_previa}) +
+                              "\n")
+                self.iniciado = True
+            archivo.write(json.dumps(self.lote) + "\n")
+            archivo.flush()
+            os.fsync(archivo.fileno())
+        self.lote = []
+
+    def vaciar(self):
+        """
+        Elimina el diario, usado después de guardar el libro de censos
+        """
+        self.previas = {}
+        self.lote = []
+        self.iniciado = False
+        if os.path.exists(self.nombre):
+            os.remove(self.nombre)
+
+
+class IndiceDonadores():
+    """
+    Conjunto de las solicitudes de los donadores que recibieron cajas. La
+    clave del donador une los últimos digitos_telefono dígitos del teléfono
+    con las palabras del nombre sin tildes, en minúscula y ordenadas, de
+    forma que "Ana Pérez, 8888-1234" y "perez ana, +506 88881234" coinciden.
+    La solicitud agrega a la clave la cantidad de cajas y los centros de
+    acopio
+
+    El índice se guarda en indice_donadores_filename junto con el contador de
+    hoja_data_delicada. Si el contador no coincide con el del libro (o el
+    archivo no existe) el índice se reconstruye con las filas de la encuesta
+    hasta el contador, que contienen las opciones de centro de acopio de cada
+    solicitud. Se registran, en el orden de la encuesta, las solicitudes de
+    cada donador hasta completar las cajas que tiene en las hojas de censos
+
+    :param solicitudes: Conjunto de solicitudes registradas
+    """
+    def __init__(self, solicitudes=()):
+        self.solicitudes = set(solicitudes)
+
+    @staticmethod
+    def clave(nombre, telefono):
+        """
+        :return: Clave normalizada del donador
+        """
+        digitos = re.sub(r"\D", "", str(telefono or ""))[-digitos_telefono:]
+        texto = unicodedata.normalize("NFKD", str(nombre or "")).casefold()
+        texto = "".join(c for c in texto if not unicodedata.combining(c))
+        return "{}|{}".format(digitos, " ".join(sorted(re.findall(r"\w+",
+                                                                  texto))))
+
+    @classmethod
+    def solicitud(cls, nombre, telefono, cajas, centros):
+        """
+        :param cajas:   Cantidad de cajas de la solicitud
+        :param centros: Centros de acopio de la solicitud
+
+        :return: Clave normalizada de la solicitud
+        """
+        return "{}|{}|{}".format(cls.clave(nombre, telefono), cajas,
+                                 "|".join(sorted(set(map(str, centros)))))
+
+    @classmethod
+    def solicitud_dueño(cls, dueño):
+        """
+        :return: Clave normalizada de la solicitud de un CensoOwner
+        """
+        return cls.solicitud(dueño.nombre, dueño.telefono,
+                             dueño.cajas_totales,
+                             (dueño.c_acopio_1, dueño.c_acopio_2))
+
+    def registrar(self, dueño):
+        """
+        Registra la solicitud de un dueño que recibió cajas
+        """
+        self.solicitudes.add(self.solicitud_dueño(dueño))
+
+    def marcar(self, data_encuesta):
+        """
+        Marca con error_repetido a los dueños con una solicitud registrada o
+        igual a otra anterior de la misma ejecución. Las solicitudes no se
+        registran, censo_spread registra las de los dueños que reciben cajas
+
+        :param data_encuesta: Iterable de objetos CensoOwner
+
+        :return: Generador de los mismos objetos CensoOwner
+        """
+        pendientes = set()
+        for dueño in data_encuesta:
+            if dueño.codigo_error is not None:
+                yield dueño
+                continue
+            solicitud = self.solicitud_dueño(dueño)
+            if solicitud in self.solicitudes or solicitud in pendientes:
+                # CRISIS 3
+                log.error("Crisis 3: Solicitud repetida del dueño {} "
+                          "telefono {}".format(dueño.nombre, dueño.telefono))
+                dueño.codigo_error = error_repetido
+            pendientes.add(solicitud)
+            yield dueño
+
+    @classmethod
+    def cargar(cls, sesion):
+        """
+        :param sesion: SesionLibros de la ejecución con el libro de censos
+
+        :return: IndiceDonadores válido para el libro de la sesión
+        """
+        fila = sesion.contadores()[0]
+        try:
+            with open(indice_donadores_filename) as arch_indice:
+                indice = json.load(arch_indice)
+            if indice["configuracion"] == [censos_filename, fila,
+                                           digitos_telefono]:
+                return cls(indice["solicitudes"])
+        except (OSError, ValueError, KeyError):
+            pass
+
+        log.info("Reconstruyendo índice de donadores desde {} y {}".format(
+            censos_filename, csv_orig_filename))
+        # Cajas de cada donador en las hojas de censos
+        cajas_libro = {}
+        for nombre, telefono, censo in sesion.donadores_registrados():
+            clave = cls.clave(nombre, telefono)
+            cajas_libro[clave] = cajas_libro.get(clave, 0) + 1
+
+        indice = cls()
+        encoding = encuesta_encoding or locale.getpreferredencoding(False)
+        with open(csv_orig_filename, newline='', encoding=encoding) as archivo:
+            for numero, registro in enumerate(csv.reader(archivo), 1):
+                if numero > fila:
+                    break
+
+                # La primera fila contiene los headers del .csv
+                if numero == 1:
+                    continue
+
+                def campo(columna):
+                    indice_campo = indice_columna(columna)
+                    if indice_campo < len(registro) and \
+                       registro[indice_campo] != "":
+                        return registro[indice_campo]
+                    return None
+
+                nombre = campo(columna_nombre)
+                telefono = campo(columna_telefono)
+                clave = cls.clave(nombre, telefono)
+                cant_cajas = (campo(columna_cant_cajas) or "").strip()
+                if cajas_libro.get(clave, 0) <= 0 or \
+                   not re.fullmatch(formato_cajas, cant_cajas) or \
+                   int(cant_cajas) <= 0:
+                    continue
+
+                indice.solicitudes.add(cls.solicitud(
+                    nombre, telefono, int(cant_cajas),
+                    (campo(columna_c_acopio_1), campo(columna_c_acopio_2))))
+                cajas_libro[clave] -= int(cant_cajas)
+        return indice
+
+    def guardar(self, fila):
+        """
+        Guarda el índice, debe llamarse después de guardar el libro
+
+        :param fila: Contador de hoja_data_delicada del libro guardado
+        """
+        guardar_json(indice_donadores_filename, {
+            "configuracion": [censos_filename, fila, digitos_telefono],
+            "solicitudes": sorted(self.solicitudes)})
+
+
+class SesionLibros():
+    """
+    Mantiene abiertos los libros de trabajo de una ejecución del script para
+    que cada archivo se cargue una única vez y se comparta entre las etapas.
+    Los libros se cargan al primer uso
+
+    :param wb:             Libro de censos con permisos de escritura, usado
+                           para la asignación de dueños
+    :param wb_lectura:     Libro de censos en modo solo lectura, usado para
+                           escanear las hojas
+    :param filas_encuesta: Cantidad de filas del archivo de encuestas que
+                           fueron leídas (valor para DATA_DELICADA)
+    :param stream:         EncuestaStream de la ejecución, su cursor se guarda
+                           junto con el archivo de resultados
+    :param cambios:        RegistroCambios con los cambios pendientes de
+                           fusionar al libro de censos
+    :param diario:         DiarioAsignaciones de las cajas distribuidas desde
+                           el último guardado
+    :param donadores:      IndiceDonadores de la ejecución
+    :param fila_error:     Última fila escrita en hoja_error
+    """
+    def __init__(self):
+        self._wb = None
+        self._wb_lectura = None
+        self.filas_encuesta = None
+        self.stream = None
+        self.cambios = RegistroCambios(cambios_filename)
+        self.diario = None
+        self.donadores = None
+        self.fila_error = None
+
+    @staticmethod
+    def _cargar(read_only):
+        import openpyxl
+
+        # Abrir archivo con información de censos
+        try:
+            return openpyxl.load_workbook(censos_filename,
+                                          read_only=read_only)
+        except Exception:
+            log.error("No existe el archivo {} en el direcctorio del "
+                      "Script".format(censos_filename))
+            raise
+
+    @property
+    def wb(self):
+        if self._wb is None:
+            with metricas.etapa("carga_libro"):
+                self._wb = self._cargar(read_only=False)
+                self.cambios.aplicar(self._wb)
+        return self._wb
+
+    @property
+    def wb_lectura(self):
+        if self._wb_lectura is None:
+            self._wb_lectura = self._cargar(read_only=True)
+        return self._wb_lectura
+
+    def leer(self, hoja, celda):
+        """
+        :return: Valor de una celda del libro de censos, considerando los
+                 cambios pendientes
+        """
+        return self.cambios.valor(hoja, celda,
+                                  self.wb_lectura[hoja][celda].value)
+
+    def columna(self, hoja, columna):
+        """
+        :return: Lista con los valores de una columna del libro de censos,
+                 considerando los cambios pendientes. El índice 0 corresponde
+                 a la fila 1
+        """
+        indice = indice_columna(columna) + 1
+        valores = [fila[0] for fila in self.wb_lectura[hoja].iter_rows(
+            min_row=1, min_col=indice, max_col=indice, values_only=True)]
+
+        for celda, valor in self.cambios.celdas.get(hoja, {}).items():
+            if celda.rstrip("0123456789") == columna:
+                fila = int(celda[len(columna):])
+                valores.extend([None] * (fila - len(valores)))
+                valores[fila - 1] = valor
+        return valores
+
+    def escribir(self, hoja, celda, valor):
+        """
+        Escribe una celda en el libro de censos o en el lote de cambios según
+        modo_escritura
+        """
+        if modo_escritura == "xlsx":
+            self.wb[hoja][celda] = valor
+        else:
+            self.cambios.escribir(hoja, celda, valor)
+
+    def max_fila(self, hoja):
+        """
+        :return: Última fila de la hoja, considerando los cambios pendientes
+        """
+        if modo_escritura == "xlsx":
+            return self.wb[hoja].max_row
+
+        from openpyxl.cell.read_only import EmptyCell
+
+        ultima = 1
+        for fila in self.wb_lectura[hoja].iter_rows():
+            for celda in fila:
+                if not isinstance(celda, EmptyCell):
+                    ultima = max(ultima, celda.row)
+        return max(ultima, self.cambios.max_fila(hoja))
+
+    def contadores(self):
+        """
+        :return: Lista con el contador de cada celda de lista_celdas en
+                 hoja_data_delicada
+        """
+        return [self.leer(hoja_data_delicada, celda) for celda in lista_celdas]
+
+    def escribir_contador(self, filas):
+        """
+        Escribe la cantidad de filas de encuesta distribuidas en cada celda de
+        lista_celdas
+        """
+        for celda in lista_celdas:
+            self.escribir(hoja_data_delicada, celda, filas)
+
+    def asignar(self, censo, row, dueño):
+        """
+        Escribe la información del dueño en el censo que inicia en la fila row
+        """
+        self.escribir(censo, columna_dueño+str(row+1), dueño.nombre)
+        self.escribir(censo, columna_dueño+str(row+2), dueño.telefono)
+
+    def agregar_error(self, dueño):
+        """
+        Escribe una fila en hoja_error con la información del dueño
+        """
+        if self.fila_error is None:
+            self.fila_error = self.max_fila(hoja_error)
+            log.debug("Errores Existentes: {}".format(self.fila_error))
+
+        self.fila_error += 1
+        for columna, valor in ((columna_nombre, dueño.nombre),
+                               (columna_telefono, dueño.telefono),
+                               (columna_c_acopio_1, dueño.c_acopio_1),
+                               (columna_c_acopio_2, dueño.c_acopio_2),
+                               (columna_cant_cajas, dueño.cant_cajas),
+                               (columna_error,
+                                msj_error[dueño.codigo_error])):
+            self.escribir(hoja_error, columna + str(self.fila_error), valor)
+
+    def donadores_registrados(self):
+        """
+        :return: Generador de tuplas (nombre, telefono, hoja), una por cada
+                 caja asignada en las hojas de censos
+        """
+        for centro_de_acopio in dict_centros_de_acopio.values():
+            for censo in centro_de_acopio:
+                # El dueño ocupa las dos filas posteriores al separador
+                columna = self.columna(censo, columna_dueño) + [None, None]
+                for i, valor in enumerate(columna[:-2]):
+                    if valor == separador_censos and \
+                       (columna[i + 1] is not None or
+                            columna[i + 2] is not None):
+                        yield columna[i + 1], columna[i + 2], censo
+
+    def hoja_encuesta(self):
+        """
+        Carga el archivo de encuestas .xlsx y registra su cantidad de filas
+
+        :return: Hoja activa del archivo de encuestas
+        """
+        import openpyxl
+
+        data_sheet = openpyxl.load_workbook(encuesta_filename).active
+        self.filas_encuesta = data_sheet.max_row
+        return data_sheet
+
+    def guardar(self):
+        """
+        Guarda el libro de censos en resultados_filename, o agrega el lote de
+        cambios a cambios_filename, y avanza el cursor de la encuesta
+        """
+        self.cerrar()
+        with metricas.etapa("guardado"):
+            if modo_escritura == "cambios":
+                self.cambios.confirmar()
+            elif modo_escritura == "hojas":
+                # El lote se confirma antes de reescribir el libro, si la
+                # ejecución se interrumpe se vuelve a aplicar
+                self.cambios.confirmar()
+                if not escribir_hojas(self.cambios.celdas):
+                    self.cambios.aplicar(self.wb)
+                    temporal = resultados_filename + ".tmp"
+                    self.wb.save(temporal)
+                    os.replace(temporal, resultados_filename)
+                self.cambios.vaciar()
+            else:
+                # Se guarda en un archivo temporal y se reemplaza el anterior
+                # para no dejar un libro incompleto si la ejecución se
+                # interrumpe durante el guardado
+                temporal = resultados_filename + ".tmp"
+                self.wb.save(temporal)
+                os.replace(temporal, resultados_filename)
+                self.cambios.vaciar()
+
+        # El cursor solo avanza una vez guardada la distribución
+        if self.stream is not None:
+            self.stream.guardar_cursor()
+
+    def cerrar(self):
+        """
+        Libera el archivo abierto por el libro de solo lectura
+        """
+        if self._wb_lectura is not None:
+            self._wb_lectura.close()
+            self._wb_lectura = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+
+
+class SesionSQLite(SesionLibros):
+    """
+    Sesión con el estado de la distribución en la base SQLite
+    estado_filename. Tablas:
+     - censos:  Una fila por censo (hoja, centro de acopio, fila del
+                separador) con el nombre, teléfono y fila de encuesta de su
+                dueño. Indexada por hoja, centro de acopio y teléfono
+     - errores: Filas de hoja_error, indexada por teléfono
+     - estado:  Contador de filas de encuesta distribuidas
+
+    Los cambios de una ejecución se confirman en una única transacción al
+    guardar. Si la base no existe se importa desde censos_filename
+    """
+    esquema = """
+        CREATE TABLE censos (hoja TEXT, centro TEXT, orden INTEGER,
+                             fila INTEGER, nombre, telefono,
+                             donador INTEGER, PRIMARY KEY (hoja, fila));
+        CREATE INDEX censos_centro ON censos (centro, orden, fila);
+        CREATE INDEX censos_libres ON censos (hoja, fila)
+            WHERE nombre IS NULL AND telefono IS NULL;
+        CREATE INDEX censos_telefono ON censos (telefono);
+        CREATE TABLE errores (fila INTEGER PRIMARY KEY, nombre, telefono,
+                              c_acopio_1, c_acopio_2, cant_cajas, error);
+        CREATE INDEX errores_telefono ON errores (telefono);
+        CREATE TABLE estado (clave TEXT PRIMARY KEY, valor);
+    """
+
+    def __init__(self):
+        import sqlite3
+
+        super().__init__()
+        if not os.path.exists(estado_filename):
+            self._importar(sqlite3)
+        self.conexion = sqlite3.connect(estado_filename)
+
+    def _importar(self, sqlite3):
+        """
+        Crea estado_filename a partir del libro de censos. La base se crea en
+        un archivo temporal para no dejar una importación incompleta
+        """
+        log.info("Importando {} a {}".format(censos_filename,
+                                             estado_filename))
+        temporal = estado_filename + ".tmp"
+        if os.path.exists(temporal):
+            os.remove(temporal)
+
+        conexion = sqlite3.connect(temporal)
+        conexion.executescript(self.esquema)
+
+        orden = 0
+        for centro_de_acopio, censos in dict_centros_de_acopio.items():
+            for censo in censos:
+                orden += 1
+                columna = self.columna(censo, columna_dueño)
+                try:
+                    fin = columna.index(break_lectura_censos)
+                except ValueError:
+                    fin = len(columna)
+                columna += [None, None]
+                conexion.executemany(
+                    "INSERT INTO censos VALUES (?, ?, ?, ?, ?, ?, NULL)",
+                    [(censo, centro_de_acopio, orden, i + 1, columna[i + 1],
+                      columna[i + 2]) for i in range(fin)
+                     if columna[i] == separador_censos])
+
+        columnas = [self.columna(hoja_error, columna)
+                    for columna in (columna_nombre, columna_telefono,
+                                    columna_c_acopio_1, columna_c_acopio_2,
+                                    columna_cant_cajas, columna_error)]
+        ultima = max(map(len, columnas))
+        columnas = [valores + [None] * (ultima - len(valores))
+                    for valores in columnas]
+        conexion.executemany(
+            "INSERT INTO errores VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(i + 1,) + fila for i, fila in enumerate(zip(*columnas))
+             if any(valor is not None for valor in fila)])
+
+        conexion.execute("INSERT INTO estado VALUES ('fila_encuesta', ?)",
+                         (super().contadores()[0],))
+        conexion.commit()
+        conexion.close()
+        super().cerrar()
+        os.replace(temporal, estado_filename)
+
+    def contadores(self):
+        valor = self.conexion.execute(
+            "SELECT valor FROM estado WHERE clave = 'fila_encuesta'"
+        ).fetchone()[0]
+        return [valor] * len(lista_celdas)
+
+    def escribir_contador(self, filas):
+        self.conexion.execute(
+            "UPDATE estado SET valor = ? WHERE clave = 'fila_encuesta'",
+            (filas,))
+
+    def asignar(self, censo, row, dueño):
+        self.conexion.execute(
+            "UPDATE censos SET nombre = ?, telefono = ?, donador = ? "
+            "WHERE hoja = ? AND fila = ?",
+            (dueño.nombre, dueño.telefono, dueño.fila, censo, row))
+
+    def agregar_error(self, dueño):
+        # Igual que en el libro, la primera fila de hoja_error es el encabezado
+        self.conexion.execute(
+            "INSERT INTO errores VALUES ("
+            "(SELECT MAX(COALESCE(MAX(fila), 0), 1) + 1 FROM errores), "
+            "?, ?, ?, ?, ?, ?)",
+            (dueño.nombre, dueño.telefono, dueño.c_acopio_1,
+             dueño.c_acopio_2, dueño.cant_cajas,
+             msj_error[dueño.codigo_error]))
+
+    def donadores_registrados(self):
+        return self.conexion.execute(
+            "SELECT nombre, telefono, hoja FROM censos "
+            "WHERE nombre IS NOT NULL OR telefono IS NOT NULL")
+
+    def censos_libres(self):
+        """
+        :return: Copia de dict_centros_de_acopio con la lista de censos sin
+                 dueño de cada censo, igual que censos_loader
+        """
+        dict_copy = deepcopy(dict_centros_de_acopio)
+        for centro_de_acopio, censos in dict_copy.items():
+            for censo, libres in censos.items():
+                libres.extend(fila for fila, in self.conexion.execute(
+                    "SELECT fila FROM censos WHERE hoja = ? AND "
+                    "nombre IS NULL AND telefono IS NULL ORDER BY fila",
+                    (censo,)))
+                metricas.sumar("censos_libres", len(libres), clave=censo)
+        return dict_copy
+
+    def guardar(self):
+        """
+        Confirma la transacción con los cambios de la ejecución y avanza el
+        cursor de la encuesta
+        """
+        self.cerrar()
+        with metricas.etapa("guardado"):
+            self.conexion.commit()
+
+        # El cursor solo avanza una vez guardada la distribución
+        if self.stream is not None:
+            self.stream.guardar_cursor()
+
+    def exportar(self):
+        """
+        Escribe el estado de la base en el libro de censos y lo guarda en
+        resultados_filename
+        """
+        wb = self.wb
+        for censo, fila, nombre, telefono in self.conexion.execute(
+                "SELECT hoja, fila, nombre, telefono FROM censos "
+                "WHERE nombre IS NOT NULL OR telefono IS NOT NULL"):
+            wb[censo][columna_dueño+str(fila+1)] = nombre
+            wb[censo][columna_dueño+str(fila+2)] = telefono
+
+        columnas = (columna_nombre, columna_telefono, columna_c_acopio_1,
+                    columna_c_acopio_2, columna_cant_cajas, columna_error)
+        for fila, *valores in self.conexion.execute(
+                "SELECT * FROM errores"):
+            for columna, valor in zip(columnas, valores):
+                wb[hoja_error][columna + str(fila)] = valor
+
+        for celda in lista_celdas:
+            wb[hoja_data_delicada][celda] = self.contadores()[0]
+
+        temporal = resultados_filename + ".tmp"
+        wb.save(temporal)
+        os.replace(temporal, resultados_filename)
+
+    def __exit__(self, *exc):
+        # Los cambios sin guardar se descartan
+        super().__exit__(*exc)
+        self.conexion.close()
+
+
+def nueva_sesion():
+    """
+    :return: SesionLibros o SesionSQLite según modo_estado
+    """
+    if modo_estado == "sqlite":
+        return SesionSQLite()
+    return SesionLibros()
+
+
+class PoolCensos():
+    """
+    Filas libres de los censos de cada centro de acopio. Cada censo guarda sus
+    filas en un deque y cada centro mantiene el índice de su primer censo con
+    filas libres. Tomar una fila es O(1) y un centro agotado se descarta de
+    inmediato sin recorrer sus censos
+
+    Con politica_censos "orden" los censos se consumen en el mismo orden que
+    en dict_centros_de_acopio. Con "balanceado" cada centro mantiene un heap
+    de sus censos por prioridad (filas libres por peso) y cada caja se toma
+    del censo con mayor prioridad en O(log k), con k censos en el centro
+
+    :param data_censos: Diccionario de diccionarios retornado por censos_loader
+    :param iniciales:   Diccionario {censo: filas libres al crear el pool}
+    """
+    def __init__(self, data_censos):
+        self.censos = {c_acopio: [(censo, deque(filas))
+                                  for censo, filas in censos.items()]
+                       for c_acopio, censos in data_censos.items()}
+        self.iniciales = {censo: len(filas)
+                          for censos in self.censos.values()
+                          for censo, filas in censos}
+
+        # Índice del primer censo con filas libres de cada centro de acopio
+        self.actual = dict.fromkeys(self.censos, 0)
+
+        # Heaps de prioridad de la política "balanceado"
+        self.heaps = {}
+        if politica_censos == "balanceado":
+            self._armar_heaps()
+
+    def _armar_heaps(self):
+        """
+        Crea el heap de cada centro de acopio con entradas
+        (-prioridad, posición del censo). heapq es un heap de mínimos, la
+        posición desempata a favor del orden de dict_centros_de_acopio
+        """
+        for c_acopio, censos in self.censos.items():
+            heap = [(-len(filas) * pesos_censos.get(censo, 1), i)
+                    for i, (censo, filas) in enumerate(censos) if filas]
+            heapq.heapify(heap)
+            self.heaps[c_acopio] = heap
+
+    def _tomar_balanceado(self, c_acopio, cantidad):
+        """
+        Toma una a una las filas del censo con mayor prioridad del centro
+        """
+        tomadas = []
+        censos = self.censos[c_acopio]
+        heap = self.heaps[c_acopio]
+        while heap and len(tomadas) < cantidad:
+            i = heap[0][1]
+            censo, filas = censos[i]
+            tomadas.append((censo, filas.popleft()))
+            if filas:
+                heapq.heapreplace(heap, (-len(filas) *
+                                         pesos_censos.get(censo, 1), i))
+            else:
+                heapq.heappop(heap)
+        return tomadas
+
+    def tomar(self, c_acopio, cantidad=1):
+        """
+        Toma en un solo paso las primeras filas libres del centro de acopio
+
+        :param c_acopio: Nombre del centro de acopio
+        :param cantidad: Cantidad de filas a tomar
+
+        :return: Lista de tuplas (censo, fila). Posee menos de cantidad
+                 elementos si el centro se completa
+        """
+        if self.heaps:
+            return self._tomar_balanceado(c_acopio, cantidad)
+
+        tomadas = []
+        censos = self.censos[c_acopio]
+        i = self.actual[c_acopio]
+        while i < len(censos) and len(tomadas) < cantidad:
+            censo, filas = censos[i]
+            n = min(cantidad - len(tomadas), len(filas))
+            tomadas.extend((censo, filas.popleft()) for _ in range(n))
+            if not filas:
+                # Censo agotado, no se vuelve a revisar
+                i += 1
+        self.actual[c_acopio] = i
+        return tomadas
+
+    def retirar(self, tomadas):
+        """
+        Descarta filas que ya fueron asignadas
+
+        :param tomadas: Conjunto de tuplas (censo, fila)
+        """
+        if not tomadas:
+            return
+        for censos in self.censos.values():
+            for censo, filas in censos:
+                libres = [fila for fila in filas
+                          if (censo, fila) not in tomadas]
+                filas.clear()
+                filas.extend(libres)
+        if self.heaps:
+            self._armar_heaps()
+
+    def disponibles(self, c_acopio):
+        """
+        :return: Cantidad de filas libres del centro de acopio
+        """
+        censos = self.censos[c_acopio]
+        return sum(len(filas) for censo, filas in censos[
+            self.actual[c_acopio]:])
+
+    def restantes(self):
+        """
+        :return: Generador de tuplas (centro de acopio, censo, filas libres)
+        """
+        for c_acopio, censos in self.censos.items():
+            for censo, filas in censos:
+                yield c_acopio, censo, len(filas)
+
+    def ocupacion(self):
+        """
+        :return: Diccionario {censo: fracción de las filas libres iniciales
+                 que fueron asignadas}
+        """
+        return {censo: (1 - len(filas) / self.iniciales[censo]
+                        if self.iniciales[censo] else 1.0)
+                for censos in self.censos.values()
+                for censo, filas in censos}
+
+
+class Simulacion():
+    """
+    Simulación en memoria de la distribución para planificar la capacidad de
+    los centros de acopio. La encuesta y las filas libres de las hojas de
+    censos se leen una única vez. Cada escenario repite la asignación de
+    censo_spread con otra relación de centros de acopio y hojas, otras
+    capacidades u otro orden de los dueños, sin leer ni escribir archivos
+
+    :param dueños:  Lista de CensoOwner de la encuesta
+    :param errores: Código de error de cada dueño al leer la encuesta
+    :param claves:      Solicitud de IndiceDonadores de cada dueño, None si
+                        no se detectan solicitudes repetidas
+    :param registradas: Solicitudes de los dueños que ya recibieron cajas en
+                        el libro de censos
+    :param libres:      Diccionario {hoja: lista de filas libres}
+    """
+    def __init__(self, fila_previa=None, hojas=()):
+        """
+        :param fila_previa: Se simulan los registros de la encuesta
+                            posteriores a esta fila. Por defecto el contador
+                            de hoja_data_delicada, de forma que los dueños
+                            que ya ocupan filas del libro no se cuentan dos
+                            veces
+        :param hojas:       Hojas de censos a leer además de las de
+                            dict_centros_de_acopio
+        """
+        with nueva_sesion() as sesion:
+            if fila_previa is None:
+                fila_previa = leer_contador(sesion)
+                if fila_previa is None:
+                    raise ValueError("Contador de {} corrupto".format(
+                        hoja_data_delicada))
+
+            self.libres = {censo: filas
+                           for censos in censos_loader(sesion).values()
+                           for censo, filas in censos.items()}
+            extra = [hoja for hoja in hojas if hoja not in self.libres]
+            if extra:
+                self.libres.update(escanear_hojas(extra, sesion))
+
+            self.registradas = set()
+            if detectar_repetidos:
+                self.registradas = IndiceDonadores.cargar(sesion).solicitudes
+
+        if modo_ingesta == "columnas":
+            self.dueños = leer_encuesta_columnas(csv_orig_filename,
+                                                 fila_previa)
+        else:
+            self.dueños = list(EncuestaStream(csv_orig_filename, fila_previa))
+        self.errores = [dueño.codigo_error for dueño in self.dueños]
+        self.claves = None
+        if detectar_repetidos:
+            self.claves = [IndiceDonadores.solicitud_dueño(dueño)
+                           for dueño in self.dueños]
+
+    def simular(self, centros=None, capacidades=None, orden=None,
+                semilla=None, motor=None):
+        """
+        Simula un escenario
+
+        :param centros:     Diccionario {centro de acopio: lista de hojas}, por
+                            defecto el de dict_centros_de_acopio
+        :param capacidades: Diccionario {hoja: cantidad de censos libres} que
+                            reemplaza la capacidad leída de la hoja
+        :param orden:       Lista de índices de self.dueños en el orden en que
+                            se asignan, por defecto el orden de la encuesta
+        :param semilla:     Si se indica, los dueños se asignan en un orden
+                            aleatorio generado con esta semilla
+        :param motor:       Motor de asignación, por defecto motor_asignacion
+
+        :return: Diccionario con las cajas solicitadas, asignadas (en
+                 primera y segunda opción), en crisis por código de error y
+                 la ocupación de cada hoja
+        """
+        global metricas
+
+        if centros is None:
+            centros = dict_centros_de_acopio
+        capacidades = capacidades or {}
+
+        data_censos = {}
+        for c_acopio, hojas in centros.items():
+            data_censos[c_acopio] = {}
+            for hoja in hojas:
+                if hoja in capacidades:
+                    filas = range(capacidades[hoja])
+                elif hoja in self.libres:
+                    filas = self.libres[hoja]
+                else:
+                    raise KeyError("Hoja {} sin capacidad leída ni "
+                                   "indicada".format(hoja))
+                data_censos[c_acopio][hoja] = list(filas)
+
+        # Los centros de acopio que eligieron los dueños y que el escenario
+        # no incluye quedan sin filas, sus cajas pasan a la segunda opción o
+        # a crisis
+        for dueño in self.dueños:
+            for c_acopio in (dueño.c_acopio_1, dueño.c_acopio_2):
+                if c_acopio not in data_censos:
+                    data_censos[c_acopio] = {}
+        pool = PoolCensos(data_censos)
+
+        if orden is None:
+            orden = range(len(self.dueños))
+        if semilla is not None:
+            orden = list(orden)
+            random.Random(semilla).shuffle(orden)
+
+        # Estado inicial de los dueños y solicitudes repetidas en el orden
+        # del escenario
+        dueños = []
+        vistos = set(self.registradas)
+        for i in orden:
+            dueño = self.dueños[i]
+            dueño.codigo_error = self.errores[i]
+            dueño.cajas_error = 0
+            if dueño.codigo_error is None and self.claves is not None:
+                if self.claves[i] in vistos:
+                    dueño.codigo_error = error_repetido
+                vistos.add(self.claves[i])
+            dueños.append(dueño)
+
+        # Los motores registran las opciones usadas en metricas
+        previas = metricas, dict(dict_centros_de_acopio_full_status)
+        metricas = Metricas()
+        try:
+            crisis = {}
+            asignadas = 0
+            for dueño, tomadas in ejecutar_motor(dueños, pool, motor):
+                asignadas += len(tomadas)
+                if dueño.cajas_error > 0:
+                    crisis[dueño.codigo_error] = \
+                        crisis.get(dueño.codigo_error, 0) + dueño.cajas_error
+            contadores = metricas.contadores
+        finally:
+            metricas = previas[0]
+            dict_centros_de_acopio_full_status.clear()
+            dict_centros_de_acopio_full_status.update(previas[1])
+
+        return {"cajas": sum(dueño.cajas_totales for dueño in dueños),
+                "asignadas": asignadas,
+                "primera_opcion": contadores.get("primera_opcion", 0),
+                "segunda_opcion": contadores.get("segunda_opcion", 0),
+                "crisis": crisis,
+                "ocupacion": pool.ocupacion()}
+
+    def escenarios(self, lista):
+        """
+        Simula varios escenarios
+
+        :param lista: Lista de diccionarios con los parámetros de simular y
+                      un "nombre" opcional
+
+        :return: Lista de resultados de simular, con el nombre de cada
+                 escenario
+        """
+        resultados = []
+        for i, escenario in enumerate(lista):
+            parametros = dict(escenario)
+            nombre = parametros.pop("nombre", "Escenario {}".format(i + 1))
+            resultados.append(dict(nombre=nombre,
+                                   **self.simular(**parametros)))
+        return resultados
+
+
 ###############################################################################
 #                                   UTILS                                     #
 ###############################################################################
+# Conversión de Columnas
+# ------------------------------------------------------------------------------
+def indice_columna(columna):
+    """
+    Convierte una letra de columna de Excel a su índice en un registro .csv
+
+    :param columna: Letra(s) de la columna, ejemplo "A" o "AB"
+
+    :return: Índice de la columna empezando en 0
+    """
+    indice = 0
+    for letra in columna.upper():
+        indice = indice * 26 + ord(letra) - ord('A') + 1
+    return indice - 1
+
+
+# Archivos Auxiliares
+# ------------------------------------------------------------------------------
+def guardar_json(nombre, datos):
+    """
+    Guarda datos en un archivo .json de forma atómica, un fallo durante la
+    escritura no deja el archivo anterior a medio escribir
+
+    :param nombre: Nombre del archivo
+    :param datos:  Objeto serializable a json
+    """
+    temporal = nombre + ".tmp"
+    with open(temporal, 'w') as archivo:
+        json.dump(datos, archivo)
+    os.replace(temporal, nombre)
+
+
+# Índice de Censos Libres
+# ------------------------------------------------------------------------------
+def partes_hojas(arch_zip):
+    """
+    :param arch_zip: zipfile.ZipFile de un archivo .xlsx
+
+    :return: Diccionario {nombre de hoja: nombre de la parte .xml de la hoja
+             dentro del archivo zip}
+    """
+    ns_libro = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+    ns_rel = "{http://schemas.openxmlformats.org/officeDocument/2006/" \
+             "relationships}"
+
+    relaciones = ElementTree.fromstring(
+        arch_zip.read("xl/_rels/workbook.xml.rels"))
+    destinos = {rel.get("Id"): rel.get("Target") for rel in relaciones}
+    libro = ElementTree.fromstring(arch_zip.read("xl/workbook.xml"))
+
+    partes = {}
+    for hoja in libro.iter(ns_libro + "sheet"):
+        destino = destinos[hoja.get(ns_rel + "id")]
+        if destino.startswith("/"):
+            partes[hoja.get("name")] = destino[1:]
+        else:
+            partes[hoja.get("name")] = "xl/" + destino
+    return partes
+
+
+def firmas_hojas(archivo):
+    """
+    Obtiene una firma del contenido de cada hoja de un archivo .xlsx sin
+    descomprimir las hojas. La firma es el CRC32 y el tamaño de la parte .xml
+    de la hoja, ambos disponibles en el directorio del archivo zip
+
+    :param archivo: Nombre del archivo .xlsx
+
+    :return: Diccionario {nombre de hoja: firma}. Vacio si el archivo no se
+             pudo interpretar
+    """
+    firmas = {}
+    try:
+        with zipfile.ZipFile(archivo) as arch_zip:
+            for hoja, parte in partes_hojas(arch_zip).items():
+                info = arch_zip.getinfo(parte)
+                firmas[hoja] = "{:08x}-{}".format(info.CRC, info.file_size)
+    except (OSError, KeyError, zipfile.BadZipFile, ElementTree.ParseError):
+        log.warning("No se pudieron obtener las firmas de las hojas de "
+                    "{}".format(archivo))
+        return {}
+
+    return firmas
+
+
+def cargar_indice_censos():
+    """
+    Carga el índice de censos libres si corresponde a censos_filename y a la
+    configuración actual de separadores
+
+    :return: Diccionario {hoja: {"firma": firma, "libres": [filas]}}
+    """
+    if not usar_indice_censos:
+        return {}
+
+    try:
+        with open(indice_censos_filename) as archivo:
+            indice = json.load(archivo)
+    except (OSError, ValueError):
+        return {}
+
+    configuracion = [censos_filename, separador_censos,
+                     break_lectura_censos, columna_dueño]
+    if indice.get("configuracion") != configuracion:
+        log.info("Indice {} no corresponde a la configuración actual, se "
+                 "ignora".format(indice_censos_filename))
+        return {}
+
+    return indice.get("hojas", {})
+
+
+def guardar_indice_censos(pool):
+    """
+    Guarda las filas libres de cada censo junto con la firma de su hoja en
+    resultados_filename. Debe llamarse después de guardar el archivo
+
+    :param pool: PoolCensos con las filas libres posteriores a la distribución
+    """
+    if not usar_indice_censos:
+        return
+
+    firmas = firmas_hojas(resultados_filename)
+    hojas = {censo: {"firma": firmas.get(censo), "libres": list(filas)}
+             for censos in pool.censos.values() for censo, filas in censos}
+
+    guardar_json(indice_censos_filename, {
+        "configuracion": [resultados_filename, separador_censos,
+                          break_lectura_censos, columna_dueño],
+        "hojas": hojas})
+
+
+# Escritura de Hojas por Flujo
+# ------------------------------------------------------------------------------
+# Elementos de la parte .xml de una hoja que procesa _reescribir_hoja
+patron_hoja = re.compile(rb'<dimension\b[^>]*>|<row\b[^>]*?(?:/>|>.*?</row>)|'
+                         rb'</sheetData>|<sheetData\s*/>', re.S)
+patron_celda = re.compile(r'<c\b[^>]*?(?:/>|>.*?</c>)', re.S)
+
+
+def _celda_xml(ref, valor, estilo=None):
+    """
+    :return: Elemento <c> de una celda. El texto se escribe en línea y los
+             números como valor, igual que openpyxl
+    """
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+    from openpyxl.utils.exceptions import IllegalCharacterError
+    from xml.sax.saxutils import escape
+
+    atributos = ' r="{}"'.format(ref)
+    if estilo is not None:
+        atributos += ' s="{}"'.format(estilo)
+
+    if valor is None:
+        return '<c{} />'.format(atributos)
+    if isinstance(valor, bool):
+        return '<c{} t="b"><v>{}</v></c>'.format(atributos, int(valor))
+    if isinstance(valor, (int, float)):
+        return '<c{} t="n"><v>{}</v></c>'.format(atributos, valor)
+
+    valor = str(valor)
+    if valor == "":
+        return '<c{} t="inlineStr" />'.format(atributos)
+    if ILLEGAL_CHARACTERS_RE.search(valor):
+        raise IllegalCharacterError(valor)
+    espacio = ' xml:space="preserve"' if valor.strip() != valor else ""
+    return '<c{} t="inlineStr"><is><t{}>{}</t></is></c>'.format(
+        atributos, espacio, escape(valor))
+
+
+def _editar_fila(fila_xml, cambios):
+    """
+    Reemplaza o agrega celdas en un elemento <row>, conservando el estilo de
+    las celdas reemplazadas
+
+    :param fila_xml: Texto del elemento <row> original
+    :param cambios:  Diccionario {columna: (celda, valor)}, columna con base 0
+
+    :return: Texto del elemento <row> modificado
+    """
+    inicio = re.match(r'<row\b([^>]*?)(/?)>', fila_xml)
+    # El rango de columnas declarado deja de ser válido
+    atributos = re.sub(r'\s+spans="[^"]*"', "", inicio.group(1))
+    contenido = "" if inicio.group(2) else \
+        fila_xml[inicio.end():-len("</row>")]
+
+    celdas = patron_celda.findall(contenido)
+    if "".join(celdas) != re.sub(r">\s+<", "><", contenido.strip()):
+        raise ValueError("Fila con elementos distintos a celdas")
+
+    por_columna = {}
+    for celda in celdas:
+        etiqueta = re.match(r'<c\b[^>]*', celda).group(0)
+        ref = re.search(r'\sr="([A-Z]+)[0-9]+"', etiqueta)
+        if ref is None:
+            raise ValueError("Celda sin referencia")
+        columna = indice_columna(ref.group(1))
+        if columna in cambios:
+            estilo = re.search(r'\ss="([0-9]+)"', etiqueta)
+            ref, valor = cambios[columna]
+            celda = _celda_xml(ref, valor, estilo and estilo.group(1))
+        por_columna[columna] = celda
+
+    for columna, (ref, valor) in cambios.items():
+        if columna not in por_columna:
+            por_columna[columna] = _celda_xml(ref, valor)
+
+    return "<row{}>{}</row>".format(
+        atributos, "".join(por_columna[columna]
+                           for columna in sorted(por_columna)))
+
+
+def _reescribir_hoja(origen, destino, celdas):
+    """
+    Copia la parte .xml de una hoja aplicando los cambios de celdas. La hoja
+    se procesa por bloques, solo las filas modificadas se interpretan
+
+    :param origen:  Archivo binario con la parte .xml original
+    :param destino: Archivo binario donde se escribe la parte modificada
+    :param celdas:  Diccionario {celda: valor} de la hoja
+    """
+    from openpyxl.utils import get_column_letter
+
+    # Cambios por fila {fila: {columna: (celda, valor)}}
+    por_fila = {}
+    for celda, valor in celdas.items():
+        columna = celda.rstrip("0123456789")
+        por_fila.setdefault(int(celda[len(columna):]), {})[
+            indice_columna(columna)] = (celda, valor)
+    nuevas = sorted(por_fila)
+
+    def filas_previas(limite):
+        # Filas modificadas que no existen en la hoja, en orden
+        texto = []
+        while nuevas and nuevas[0] < limite:
+            fila = nuevas.pop(0)
+            texto.append(_editar_fila('<row r="{}">'.format(fila) + "</row>",
+                                      por_fila[fila]))
+        return "".join(texto).encode()
+
+    buffer = b""
+    sheet_data = False
+    while True:
+        bloque = origen.read(1 << 16)
+        buffer += bloque
+        posicion = 0
+        for elemento in patron_hoja.finditer(buffer):
+            texto = elemento.group(0)
+            destino.write(buffer[posicion:elemento.start()])
+            posicion = elemento.end()
+
+            if texto.startswith(b"<dimension"):
+                # Rango de la hoja ampliado a las celdas nuevas
+                ref = re.search(rb'ref="[A-Z]*([0-9]*):?([A-Z]*)([0-9]*)"',
+                                texto)
+                filas = max([int(ref.group(3) or ref.group(1) or 1)] +
+                            nuevas)
+                columnas = max([indice_columna(
+                    (ref.group(2) or b"A").decode()) + 1] +
+                    [columna + 1 for cambios in por_fila.values()
+                     for columna in cambios])
+                texto = '<dimension ref="A1:{}{}" />'.format(
+                    get_column_letter(columnas), filas).encode()
+            elif texto.startswith(b"<row"):
+                numero = re.match(rb'<row\b[^>]*?\sr="([0-9]+)"', texto)
+                if numero is None:
+                    raise ValueError("Fila sin número")
+                numero = int(numero.group(1))
+                destino.write(filas_previas(numero))
+                if numero in por_fila:
+                    nuevas.remove(numero)
+                    texto = _editar_fila(texto.decode("utf-8"),
+                                         por_fila[numero]).encode()
+            else:
+                # Fin de los datos de la hoja
+                sheet_data = True
+                texto = b"<sheetData>" * texto.startswith(b"<sheetData") + \
+                    filas_previas(float("inf")) + b"</sheetData>"
+            destino.write(texto)
+
+            if sheet_data:
+                break
+
+        buffer = buffer[posicion:]
+        if sheet_data or not bloque:
+            break
+
+        # Se conserva el elemento incompleto al final del bloque
+        corte = buffer.rfind(b"<row")
+        if corte < 0:
+            corte = buffer.rfind(b"<")
+        if corte > 0:
+            destino.write(buffer[:corte])
+            buffer = buffer[corte:]
+
+    if not sheet_data:
+        raise ValueError("Hoja sin elemento sheetData")
+
+    # Resto de la hoja sin cambios
+    destino.write(buffer)
+    shutil.copyfileobj(origen, destino, 1 << 20)
+
+
+def escribir_hojas(celdas):
+    """
+    Escribe los cambios de celdas en resultados_filename a partir de
+    censos_filename sin cargar el libro con openpyxl. Las partes del archivo
+    se procesan una a la vez: las hojas modificadas se reescriben por bloques
+    y el resto se copia sin cambios, la memoria usada no depende del tamaño
+    del libro
+
+    :param celdas: Diccionario {hoja: {celda: valor}}
+
+    :return: False si el libro no tiene el formato esperado, en ese caso
+             resultados_filename no se modifica
+    """
+    temporal = resultados_filename + ".tmp"
+    try:
+        with zipfile.ZipFile(censos_filename) as origen:
+            partes = {parte: hoja for hoja, parte
+                      in partes_hojas(origen).items() if hoja in celdas}
+            if len(partes) != len(celdas):
+                raise KeyError("Hojas inexistentes en {}".format(
+                    censos_filename))
+
+            with zipfile.ZipFile(temporal, 'w') as destino:
+                for info in origen.infolist():
+                    nueva = zipfile.ZipInfo(info.filename, info.date_time)
+                    nueva.compress_type = info.compress_type
+                    nueva.external_attr = info.external_attr
+                    zip64 = info.file_size > 1 << 30
+                    with origen.open(info) as arch_origen, \
+                            destino.open(nueva, 'w', force_zip64=zip64) \
+                            as arch_destino:
+                        if info.filename in partes:
+                            with metricas.etapa("escritura_hojas"):
+                                _reescribir_hoja(
+                                    arch_origen, arch_destino,
+                                    celdas[partes[info.filename]])
+                        else:
+                            shutil.copyfileobj(arch_origen, arch_destino,
+                                               1 << 20)
+    except (ValueError, KeyError, zipfile.BadZipFile,
+            ElementTree.ParseError) as e:
+        log.warning("No se pudo escribir {} por hojas ({}), se guardara el "
+                    "libro completo".format(resultados_filename, e))
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        return False
+
+    os.replace(temporal, resultados_filename)
+    metricas.sumar("hojas_reescritas", len(celdas))
+    return True
+
+
+# Sello de la Última Ejecución
+# ------------------------------------------------------------------------------
+def estado_archivo(nombre):
+    """
+    :return: Lista [nombre, tamaño, fecha de modificación en ns] del archivo,
+             con None en tamaño y fecha si no existe
+    """
+    try:
+        estado = os.stat(nombre)
+    except FileNotFoundError:
+        return [nombre, None, None]
+    return [nombre, estado.st_size, estado.st_mtime_ns]
+
+
+def estado_libros():
+    """
+    :return: Lista con estado_archivo de cada archivo de la distribución
+    """
+    return [estado_archivo(nombre) for nombre in
+            (censos_filename, resultados_filename, cambios_filename,
+             diario_filename, indice_donadores_filename, estado_filename)]
+
+
+def guardar_sello(encuesta):
+    """
+    Guarda el sello de una ejecución finalizada
+
+    :param encuesta: estado_archivo de csv_orig_filename tomado antes de leer
+                     la encuesta. Si la encuesta creció durante la lectura el
+                     sello no coincide y la siguiente ejecución la revisa
+    """
+    guardar_json(sello_filename, {"encuesta": encuesta,
+                                  "libros": estado_libros()})
+
+
+def sin_cambios():
+    """
+    Chequeo rápido previo a importar openpyxl y cargar los libros
+
+    :return: True si la encuesta y los libros no cambiaron desde la última
+             ejecución finalizada
+    """
+    try:
+        with open(sello_filename) as arch_sello:
+            sello = json.load(arch_sello)
+    except (OSError, ValueError):
+        return False
+
+    return sello == {"encuesta": estado_archivo(csv_orig_filename),
+                     "libros": estado_libros()}
+
+
 # Conversor de CSV a XLSX
 # ------------------------------------------------------------------------------
+# Parte .xml de la hoja de encuestas dentro de encuesta_filename
+parte_hoja_encuesta = "xl/worksheets/sheet1.xml"
+
+
+def _conversion_previa(archivo, arch_csv, hash_csv):
+    """
+    Verifica que la conversión guardada en conversion_filename corresponda
+    al archivo encuesta_filename actual y a un prefijo sin cambios del .csv
+
+    :param archivo:  Archivo .csv abierto en modo binario
+    :param arch_csv: Nombre del archivo de encuestas con extención .csv
+    :param hash_csv: Objeto hashlib donde se acumula el prefijo leído
+
+    :return: Diccionario de la conversión previa o None si no es utilizable
+    """
+    try:
+        with open(conversion_filename) as arch_conversion:
+            conversion = json.load(arch_conversion)
+    except (OSError, ValueError):
+        return None
+
+    if conversion.get("archivo") != arch_csv or \
+       conversion.get("hoja") != encuesta_sheet_name or \
+       conversion.get("xlsx") != estado_archivo(encuesta_filename):
+        return None
+
+    # El prefijo ya convertido no debe haber cambiado
+    offset = conversion.get("offset", 0)
+    if offset > os.fstat(archivo.fileno()).st_size:
+        return None
+    pendiente = offset
+    while pendiente:
+        bloque = archivo.read(min(pendiente, 1 << 20))
+        hash_csv.update(bloque)
+        pendiente -= len(bloque)
+    if hash_csv.hexdigest() != conversion.get("sha256"):
+        log.info("Registros previos de {} cambiaron, se convertira el archivo "
+                 "completo".format(arch_csv))
+        return None
+
+    return conversion
+
+
+def _fila_xml(registro, fila):
+    """
+    :return: Elemento <row> de la hoja con los valores del registro como
+             texto en línea, igual al generado por openpyxl
+    """
+    from openpyxl.utils import get_column_letter
+
+    return '<row r="{}">{}</row>'.format(fila, "".join(
+        _celda_xml(get_column_letter(columna + 1) + str(fila), valor)
+        for columna, valor in enumerate(registro)))
+
+
+def anexar_filas_xlsx(registros, fila_inicial, columnas):
+    """
+    Agrega filas al final de la hoja de encuesta_filename sin cargar el
+    libro con openpyxl. Solo se reescribe la parte .xml de la hoja, el resto
+    de partes del archivo zip se copian sin cambios
+
+    :param registros:    Lista de registros (listas de texto) a agregar
+    :param fila_inicial: Fila de la hoja del primer registro
+    :param columnas:     Cantidad de columnas de la hoja tras agregar
+
+    :return: False si la hoja no tiene el formato esperado
+    """
+    from openpyxl.utils import get_column_letter
+
+    filas = "".join(_fila_xml(registro, fila_inicial + indice)
+                    for indice, registro in enumerate(registros)
+                    if registro)
+    ultima = fila_inicial + len(registros) - 1
+    dimension = '<dimension ref="A1:{}{}"'.format(
+        get_column_letter(max(columnas, 1)), ultima).encode()
+
+    temporal = encuesta_filename + ".tmp"
+    with zipfile.ZipFile(encuesta_filename) as origen:
+        if parte_hoja_encuesta not in origen.namelist():
+            return False
+        hoja = origen.read(parte_hoja_encuesta)
+        for vacia in (b'<sheetData />', b'<sheetData/>'):
+            hoja = hoja.replace(vacia, b'<sheetData></sheetData>', 1)
+        fin = hoja.rfind(b'</sheetData>')
+        if fin < 0:
+            return False
+        hoja = hoja[:fin] + filas.encode() + hoja[fin:]
+        hoja = re.sub(rb'<dimension ref="[^"]*"', dimension, hoja, count=1)
+
+        with zipfile.ZipFile(temporal, 'w', zipfile.ZIP_DEFLATED) as destino:
+            for parte in origen.infolist():
+                if parte.filename == parte_hoja_encuesta:
+                    destino.writestr(parte, hoja)
+                else:
+                    destino.writestr(parte, origen.read(parte))
+    os.replace(temporal, encuesta_filename)
+    return True
+
+
 def conv_to_xlsx(arch_csv):
     """
     Carga un archivo de encuestas .csv y lo convierte a formato .xlsx para
     su procesamiento con openpyxl
 
+    Si conversion_filename indica que encuesta_filename ya contiene un
+    prefijo sin cambios del .csv, solo se agregan los registros posteriores.
+    En caso contrario el archivo se reconstruye completo con un libro de solo
+    escritura
+
     :param arch_csv: Nombre del archivo de encuestas con extención .csv
     """
+    import openpyxl
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+    encoding = encuesta_encoding or locale.getpreferredencoding(False)
+
     # Abrir el archivo
     try:
-        encuesta_csv = open(arch_csv)
-
+        archivo = open(arch_csv, 'rb')
     except Exception:
         log.error("Archivo de encuentas {} no se encuentra".format(arch_csv))
         raise
@@ -241,44 +2280,109 @@ def conv_to_xlsx(arch_csv):
     # Demarca el signo que usa el .csv para separar su información
     csv.register_dialect('colons', delimiter=',')
 
-    # Carga el contenido del archivo .csv
-    lectura = csv.reader(encuesta_csv, dialect='colons')
-
-    # Definir objeto de xlsx con una hoja de nombre específico
-    wb = openpyxl.Workbook()
-    ws = wb.worksheets[0]
-    ws.title = encuesta_sheet_name
-
-    # Conversión del .csv al objeto woorkbook
-    for row_index, row in enumerate(lectura):
-        for column_index, cell in enumerate(row):
-            # Coordenadas de cell empiezan en 1,1
-            ws.cell(column=column_index + 1, row=(row_index + 1)).value = cell
-
-    # Guarda el archivo de encuestas
-    wb.save(filename=encuesta_filename)
+    with archivo:
+        hash_csv = hashlib.sha256()
+        conversion = _conversion_previa(archivo, arch_csv, hash_csv)
+
+        if conversion is not None:
+            offset = conversion["offset"]
+            resto = archivo.read()
+            hash_csv.update(resto)
+            tamaño = offset + len(resto)
+            if not resto:
+                log.debug("Sin registros nuevos en {}".format(arch_csv))
+                return
+
+            # Si el último registro convertido no terminaba en salto de
+            # línea, el salto agregado al anexar registros no es un registro
+            if offset > 0:
+                archivo.seek(offset - 1)
+                if archivo.read(1) != b'\n':
+                    for salto in (b'\r\n', b'\n'):
+                        if resto.startswith(salto):
+                            resto = resto[len(salto):]
+                            break
+
+            # Los saltos de línea se traducen igual que al abrir el .csv en
+            # modo texto
+            lectura = csv.reader(io.StringIO(resto.decode(encoding),
+                                             newline=None), dialect='colons')
+            registros = list(lectura)
+            columnas = max([conversion["columnas"]] +
+                           [len(registro) for registro in registros])
+
+            # Valores que openpyxl no acepta se dejan a la conversión
+            # completa, que reporta el error
+            validos = not any(ILLEGAL_CHARACTERS_RE.search(valor)
+                              for registro in registros for valor in registro)
+            if validos and anexar_filas_xlsx(registros,
+                                             conversion["filas"] + 1,
+                                             columnas):
+                log.info("{} registros nuevos agregados a {}".format(
+                    len(registros), encuesta_filename))
+                guardar_json(conversion_filename, {
+                    "archivo": arch_csv,
+                    "hoja": encuesta_sheet_name,
+                    "filas": conversion["filas"] + len(registros),
+                    "columnas": columnas,
+                    "offset": tamaño,
+                    "sha256": hash_csv.hexdigest(),
+                    "xlsx": estado_archivo(encuesta_filename)})
+                return
+
+        # Conversión completa
+        archivo.seek(0)
+        datos = archivo.read()
+        lectura = csv.reader(io.StringIO(datos.decode(encoding), newline=None),
+                             dialect='colons')
+
+        # Libro de solo escritura con una hoja de nombre específico
+        wb = openpyxl.Workbook(write_only=True)
+        ws = wb.create_sheet(encuesta_sheet_name)
+
+        filas = columnas = 0
+        for row in lectura:
+            ws.append(row)
+            filas += 1
+            columnas = max(columnas, len(row))
+
+        # Guarda el archivo de encuestas
+        temporal = encuesta_filename + ".tmp"
+        wb.save(filename=temporal)
+        os.replace(temporal, encuesta_filename)
+
+    guardar_json(conversion_filename, {
+        "archivo": arch_csv,
+        "hoja": encuesta_sheet_name,
+        "filas": filas,
+        "columnas": columnas,
+        "offset": len(datos),
+        "sha256": hashlib.sha256(datos).hexdigest(),
+        "xlsx": estado_archivo(encuesta_filename)})
 
 
 # Parser de Excel de Encuestas
 # ------------------------------------------------------------------------------
-def data_loader(fila_previa):
+def data_loader(fila_previa, sesion=None):
     """
     Procesa y almacena la información del archivo de encuesta extensión .xlsx
     en un array de clases tipo CensoOwner
 
     :param fila_previa: Contiene el valor de la última fila que fue analizada
+    :param sesion:      SesionLibros de la ejecución, registra la cantidad de
+                        filas de la encuesta
 
-    :return: Un array de clases tipo CensoOwner
+    :return: Un array de clases tipo CensoOwner, uno por donador
     """
     parsed_data = []
 
     # Abrir el Excel de encuestas
-    wb = openpyxl.load_workbook(encuesta_filename)
-    data_sheet = wb.active
+    sesion = sesion or nueva_sesion()
+    data_sheet = sesion.hoja_encuesta()
 
     # Ciclo for para iterar sobre todas las filas de la encuesta
-    print(data_sheet.max_row)
-    print(fila_previa)
+    log.debug("Filas en encuesta: {}, ultima fila analizada: {}".format(
+        data_sheet.max_row, fila_previa))
     for row in range(fila_previa, data_sheet.max_row):
 
         # En los objetos de openpyxl no existe el indice 0 para filas
@@ -289,53 +2393,350 @@ def data_loader(fila_previa):
         if file_row is 1:
             continue
 
-        # Un mismo donador podria entregar más de una caja
-        cajas_totales = \
-            int(data_sheet[columna_cant_cajas + str(file_row)].value)
+        # Las filas vacías se omiten igual que en los demás modos
+        if all(celda.value is None for celda in data_sheet[file_row]):
+            continue
+
+        # Un mismo donador podria entregar más de una caja, se guarda una
+        # única vez con su cantidad de cajas
+        cant_cajas = data_sheet[columna_cant_cajas + str(file_row)].value
+        cajas_totales = int(cant_cajas)
+        if cajas_totales <= 0:
+            continue
+
+        parsed_data.append(CensoOwner(
+            nombre=data_sheet[columna_nombre+str(file_row)].value,
+            telefono=data_sheet[columna_telefono+str(file_row)].value,
+            c_ac_1=data_sheet[columna_c_acopio_1+str(file_row)].value,
+            c_ac_2=data_sheet[columna_c_acopio_2+str(file_row)].value,
+            cant_cajas=cant_cajas,
+            cajas_totales=cajas_totales,
+            fila=file_row))
+
+    return parsed_data
+
+
+# Lectura de la Encuesta en Columnas
+# ------------------------------------------------------------------------------
+# Expresión de una cantidad de cajas válida, igual en todos los motores
+formato_cajas = r"-?[0-9]+"
+
+
+def _columnas_pyarrow(arch_csv, indices, encoding):
+    """
+    :return: Tupla (lista de columnas de texto, lista de cantidades de cajas
+             con None en las inválidas, total de cajas válidas)
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    from pyarrow import csv as pa_csv
+
+    nombres = ["f{}".format(indice) for indice in indices]
+    tabla = pa_csv.read_csv(
+        arch_csv,
+        read_options=pa_csv.ReadOptions(autogenerate_column_names=True,
+                                        encoding=encoding),
+        parse_options=pa_csv.ParseOptions(ignore_empty_lines=False),
+        convert_options=pa_csv.ConvertOptions(
+            include_columns=nombres,
+            column_types={nombre: pa.string() for nombre in nombres},
+            strings_can_be_null=False))
+
+    texto = pc.utf8_trim_whitespace(tabla.column(nombres[-1]))
+    validas = pc.match_substring_regex(texto, "^" + formato_cajas + "$")
+    cajas = pc.cast(pc.if_else(validas, texto, "0"), pa.int64())
+    total = pc.sum(pc.if_else(pc.greater(cajas, 0), cajas, 0)).as_py()
+    cajas = pc.if_else(validas, cajas, pa.scalar(None, pa.int64()))
+
+    return ([tabla.column(nombre).to_pylist() for nombre in nombres],
+            cajas.to_pylist(), total or 0)
+
+
+def _columnas_pandas(arch_csv, indices, encoding):
+    """
+    :return: Tupla (lista de columnas de texto, lista de cantidades de cajas
+             con None en las inválidas, total de cajas válidas)
+    """
+    import pandas as pd
+
+    tabla = pd.read_csv(arch_csv, header=None, usecols=indices, dtype=str,
+                        keep_default_na=False, skip_blank_lines=False,
+                        encoding=encoding).fillna("")
+
+    texto = tabla[indices[-1]].str.strip()
+    validas = texto.str.fullmatch(formato_cajas)
+    cajas = pd.to_numeric(texto.where(validas, "0")).astype("int64")
+    total = int(cajas.clip(lower=0).sum())
+
+    return ([tabla[indice].tolist() for indice in indices],
+            [int(c) if v else None
+             for c, v in zip(cajas.tolist(), validas.tolist())], total)
 
-        for cant_cajas in range(cajas_totales):
-            parsed_data.append(CensoOwner(
-                nombre=data_sheet[columna_nombre+str(file_row)].value,
-                telefono=data_sheet[columna_telefono+str(file_row)].value,
-                c_ac_1=data_sheet[columna_c_acopio_1+str(file_row)].value,
-                c_ac_2=data_sheet[columna_c_acopio_2+str(file_row)].value,
-                cant_cajas=data_sheet[columna_cant_cajas+str(file_row)].value))
 
+def _columnas_stdlib(arch_csv, indices, encoding):
+    """
+    :return: Tupla (lista de columnas de texto, lista de cantidades de cajas
+             con None en las inválidas, total de cajas válidas)
+    """
+    with open(arch_csv, newline='', encoding=encoding) as archivo:
+        registros = list(csv.reader(archivo, delimiter=','))
+
+    columnas = [[registro[indice] if indice < len(registro) else ""
+                 for registro in registros] for indice in indices]
+
+    validas = re.compile(formato_cajas)
+    cajas = [int(texto) if validas.fullmatch(texto.strip()) else None
+             for texto in columnas[-1]]
+    total = sum(c for c in cajas if c is not None and c > 0)
+
+    return columnas, cajas, total
+
+
+def leer_encuesta_columnas(arch_csv, fila_previa, sesion=None):
+    """
+    Lee el archivo de encuestas .csv completo en columnas con motor_lectura.
+    Las cantidades de cajas se validan y convierten en bloque. Las filas con
+    una cantidad que no es un número entero o con un centro de acopio que no
+    existe generan un CensoOwner con codigo_error error_formato, que se
+    documenta en hoja_error. Las filas vacías se omiten
+
+    :param arch_csv:    Nombre del archivo de encuestas con extención .csv
+    :param fila_previa: Contiene el valor de la última fila que fue analizada
+    :param sesion:      SesionLibros de la ejecución, registra la cantidad de
+                        filas de la encuesta
+
+    :return: Un array de clases tipo CensoOwner, uno por donador
+    """
+    encoding = encuesta_encoding or locale.getpreferredencoding(False)
+    indices = [indice_columna(columna) for columna in
+               (columna_nombre, columna_telefono, columna_c_acopio_1,
+                columna_c_acopio_2, columna_cant_cajas)]
+
+    # Motor de lectura disponible
+    lectores = {"pyarrow": _columnas_pyarrow, "pandas": _columnas_pandas}
+    motores = ["pyarrow", "pandas"] if motor_lectura == "auto" else \
+        [motor_lectura]
+    for motor in motores + ["stdlib"]:
+        try:
+            columnas, cajas, total = lectores.get(
+                motor, _columnas_stdlib)(arch_csv, indices, encoding)
+            break
+        except ImportError:
+            log.debug("Motor de lectura {} no disponible".format(motor))
+        except ValueError as error:
+            if motor == "stdlib":
+                raise
+            log.warning("Motor de lectura {} no logro leer {}, se usa el "
+                        "siguiente: {}".format(motor, arch_csv, error))
+    log.debug("Encuesta leida con el motor {}".format(motor))
+
+    if sesion is not None:
+        sesion.filas_encuesta = len(cajas)
+
+    # La primera fila contiene los headers del .csv
+    inicio = max(fila_previa, 1)
+    parsed_data = []
+    for fila, nombre, telefono, c_ac_1, c_ac_2, cant_cajas, cajas_totales \
+            in zip(range(inicio + 1, len(cajas) + 1),
+                   *[columna[inicio:] for columna in columnas],
+                   cajas[inicio:]):
+        if cajas_totales is not None and cajas_totales <= 0:
+            continue
+
+        # Fila vacía
+        if not (nombre or telefono or c_ac_1 or c_ac_2 or cant_cajas):
+            continue
+
+        dueño = CensoOwner(nombre or None, telefono or None, c_ac_1 or None,
+                           c_ac_2 or None, cant_cajas or None,
+                           cajas_totales or 1, fila)
+
+        # Fila con cantidad de cajas inválida o centro de acopio desconocido,
+        # se documenta una fila de error
+        if cajas_totales is None or \
+           dueño.c_acopio_1 not in dict_centros_de_acopio or \
+           dueño.c_acopio_2 not in dict_centros_de_acopio:
+            # CRISIS 4
+            log.error("Crisis 4: Fila {} de la encuesta invalida, cajas '{}' "
+                      "centros de acopio '{}' y '{}'".format(
+                        fila, cant_cajas, c_ac_1, c_ac_2))
+            dueño.codigo_error = error_formato
+            metricas.sumar("filas_invalidas")
+        parsed_data.append(dueño)
+
+    log.debug("Cajas solicitadas en la encuesta: {}".format(total))
     return parsed_data
 
 
+# Escaner de Hojas de Censos
+# ------------------------------------------------------------------------------
+def leer_columna_dueño(hoja):
+    """
+    Lee en una única pasada secuencial los valores de columna_dueño de una
+    hoja de censos, sin construir coordenadas ni objetos de celda por fila
+
+    :param hoja: Hoja de censos, idealmente de un libro de solo lectura
+
+    :return: Lista con el valor de cada fila de la columna. El índice 0
+             corresponde a la fila 1
+    """
+    indice = indice_columna(columna_dueño) + 1
+    return [fila[0] for fila in hoja.iter_rows(min_row=1,
+                                                min_col=indice,
+                                                max_col=indice,
+                                                values_only=True)]
+
+
+def buscar_censos_libres(columna, censo):
+    """
+    Encuentra los censos sin dueño en los valores de columna_dueño de una hoja
+
+    Se sabe que se encontro un censo cuando se encuentra una casilla que posee
+    el símbolo separador_censos. A su vez se sabe que este no tiene un dueño
+    si las siguientes dos filas estan vacias. (Aqui es donde se encontraría la
+    información de dueño y numero de celular). La busqueda se detiene en el
+    símbolo break_lectura_censos
+
+    :param columna: Lista de valores retornada por leer_columna_dueño
+    :param censo:   Nombre de la hoja, usado en los mensajes de log
+
+    :return: Lista con los números de fila de los censos sin dueño
+    """
+    # Detener Lectura
+    try:
+        fin = columna.index(break_lectura_censos)
+        log.info("Se encontro simbolo de break {}, todos los censos de {} "
+                 "posteriores a la linea {} no seran distribuidos".format(
+                    break_lectura_censos, censo, fin + 1))
+    except ValueError:
+        fin = len(columna)
+
+    # Las filas posteriores al final de la hoja se consideran vacias
+    valores = columna + [None, None]
+
+    # En los objetos de openpyxl no existe el indice 0 para filas, por eso el
+    # numero de fila es el indice + 1
+    return [i + 1 for i in range(fin)
+            if valores[i] == separador_censos and
+            valores[i + 1] is None and valores[i + 2] is None]
+
+
+# Lectura en Paralelo de Hojas de Censos
+# ------------------------------------------------------------------------------
+# Libro de solo lectura propio de cada proceso de lectura
+_libro_lectura = None
+
+
+def _iniciar_lector(archivo, configuracion):
+    """
+    Inicializa un proceso de lectura con su propio libro de solo lectura y
+    con la configuración de separadores del proceso principal
+
+    :param archivo:       Nombre del archivo de censos
+    :param configuracion: Tupla (separador_censos, break_lectura_censos,
+                          columna_dueño)
+    """
+    import openpyxl
+
+    global _libro_lectura, separador_censos, break_lectura_censos, \
+        columna_dueño
+    separador_censos, break_lectura_censos, columna_dueño = configuracion
+    _libro_lectura = openpyxl.load_workbook(archivo, read_only=True)
+
+
+def _escanear_hoja(censo):
+    """
+    Lee una hoja de censos en un proceso de lectura
+
+    :param censo: Nombre de la hoja
+
+    :return: Tupla (filas leídas, lista con los números de fila de los censos
+             sin dueño)
+    """
+    columna = leer_columna_dueño(_libro_lectura[censo])
+    return len(columna), buscar_censos_libres(columna, censo)
+
+
+def escanear_hojas(censos, sesion):
+    """
+    Busca los censos sin dueño de varias hojas. Si procesos_lectura_censos es
+    mayor a 1 cada hoja se lee en un proceso distinto
+
+    :param censos: Lista con los nombres de las hojas
+    :param sesion: SesionLibros de la ejecución con el libro de censos
+
+    :return: Diccionario {hoja: lista de filas libres}, en el orden de censos
+    """
+    if procesos_lectura_censos <= 1 or len(censos) <= 1:
+        resultados = []
+        for censo in censos:
+            columna = leer_columna_dueño(sesion.wb_lectura[censo])
+            resultados.append((len(columna),
+                               buscar_censos_libres(columna, censo)))
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        configuracion = (separador_censos, break_lectura_censos,
+                         columna_dueño)
+        with ProcessPoolExecutor(max_workers=min(procesos_lectura_censos,
+                                                 len(censos)),
+                                 initializer=_iniciar_lector,
+                                 initargs=(censos_filename,
+                                           configuracion)) as ejecutor:
+            # map conserva el orden de las hojas sin importar cual termina
+            # primero
+            resultados = list(ejecutor.map(_escanear_hoja, censos))
+
+    leidas = {}
+    for censo, (filas, libres) in zip(censos, resultados):
+        metricas.sumar("filas_escaneadas", filas, clave=censo)
+        leidas[censo] = libres
+    return leidas
+
+
 # Parser de Excel de Censos
 # ------------------------------------------------------------------------------
-def censos_loader():
+def censos_loader(sesion=None):
     """
     Procesa y almacena la información del archivo de censos extensión .xlsx
     Guarda en las listas del diccionario de centros de acopios el numero
     de las celdas respectivas a una caja donde no se a asignado a un dueño
 
+    :param sesion: SesionLibros de la ejecución con el libro de censos
+
     :return: Una copia de la variable global dict_centros_de_acopio con la
              lista de censos sin dueño asociada a cada Censo
     """
     global dict_centros_de_acopio
 
+    # Con modo_estado "sqlite" los censos libres se consultan en la base
+    sesion = sesion or nueva_sesion()
+    if modo_estado == "sqlite":
+        return sesion.censos_libres()
+
     # Copia completa al diccionario de centros de acopio
     dict_copy = deepcopy(dict_centros_de_acopio)
 
-    # Abrir archivo con información de censos
-    try:
-        wb = openpyxl.load_workbook(censos_filename)
-    except Exception:
-        log.error("No existe el archivo {} en el direcctorio del "
-                  "Script".format(censos_filename))
-        raise
+    # Hojas sin cambios desde la última ejecución se toman del índice
+    indice = cargar_indice_censos()
+    firmas = firmas_hojas(censos_filename) if indice else {}
+    nombres_hojas = list(firmas) or sesion.wb_lectura.sheetnames
 
     # Sanity Check: Asegurar que las hojas son parte del diccionario
     for centro_de_acopio in dict_copy.values():
         for censo in centro_de_acopio.keys():
-            if censo not in wb.sheetnames:
+            if censo not in nombres_hojas:
                 log.error("Censo de nombre {} no es una hoja existente del "
                           "archivo {}".format(censo, censos_filename))
                 raise KeyError("Worksheet {} does not exist.".format(censo))
 
+    # Hojas cuyo índice no es válido y deben leerse
+    por_leer = [censo for centro_de_acopio in dict_copy.values()
+                for censo in centro_de_acopio.keys()
+                if censo not in indice or
+                indice[censo]["firma"] != firmas.get(censo)]
+    leidas = escanear_hojas(por_leer, sesion)
+
     # Parser de la información
     # Ciclo for para cada centro de acopio en el diccionario principal
     for centro_de_acopio in dict_copy.keys():
@@ -344,77 +2745,101 @@ def censos_loader():
         # Ciclo for para cada Censo dentro del Centro de Acopio Actual
         for censo in dict_copy[centro_de_acopio].keys():
             log.debug(censo)
-            hoja_actual = wb[censo]
-            log.debug(hoja_actual.max_row)
-
-            # For para analizar cada celda
-            for i in range(hoja_actual.max_row):
-
-                # En los objetos de openpyxl no existe el indice 0 para filas
-                # o columnas, por eso el numero de fila se debe actualizar
-                row = i + 1
-
-                # Deteccion de censo
-                # Se sabe que se encontro un censo cuando se encuentra una
-                # casilla que posee el símbolo separador_censos.
-                # A su vez se sabe que este no tiene un dueño si las siguientes
-                # dos filas estan vacias. (Aqui es donde se encontraría la
-                # información de dueño y numero de celular)
-                censo_libre = (
-                    hoja_actual[columna_dueño + str(row)].value ==
-                    separador_censos and
-                    hoja_actual[columna_dueño + str(row+1)].value is None and
-                    hoja_actual[columna_dueño + str(row+2)].value is None)
-
-                if censo_libre:
-                    dict_copy[centro_de_acopio][censo].append(row)
-
-                # Detener Lectura
-                if hoja_actual[columna_dueño + str(row)].value == \
-                   break_lectura_censos:
-                    log.info("Se encontro simbolo de break {}, todos los"
-                             " censos de {} posteriores a la linea {} no seran"
-                             " distribuidos".format(break_lectura_censos,
-                                                    censo, row))
-                    break
+
+            if censo in leidas:
+                libres = leidas[censo]
+            else:
+                log.debug("Hoja {} sin cambios, se usa el indice".format(
+                    censo))
+                libres = indice[censo]["libres"]
+                metricas.sumar("hojas_desde_indice")
+
+            # Censos asignados en cambios pendientes de fusionar
+            pendientes = sesion.cambios.celdas.get(censo)
+            if pendientes:
+                libres = [row for row in libres
+                          if columna_dueño + str(row + 1) not in pendientes and
+                          columna_dueño + str(row + 2) not in pendientes]
+
+            dict_copy[centro_de_acopio][censo].extend(libres)
+
+            metricas.sumar("censos_libres",
+                           len(dict_copy[centro_de_acopio][censo]),
+                           clave=censo)
 
     return dict_copy
 
 
-# Parser de Excel de Censos
+# Lotes de Distribución
 # ------------------------------------------------------------------------------
-def censo_spread(data_encuesta, data_censos):
+def lotes_encuesta(data_encuesta, sesion):
     """
-    Algoritmo principal de distribución de cajas. Asocia a cada posible dueño
-    con un censo. Modifica el archivo de censos extensión .xlsx con el nombre
-    y número de teléfono del encargado
+    Divide los donadores en lotes de donadores_por_lote. Antes de entregar
+    cada lote actualiza sesion.filas_encuesta con la última fila de la
+    encuesta que cubre el lote, de forma que cada guardado del libro
+    deje el contador de hoja_data_delicada en un punto de reinicio válido
 
-    :param data_encuesta: Lista de objetos CensoOwner con informacion de los
-                          posibles dueños de censos
-    :param data_censos:   Diccionario de diccionarios con informacion de los
-                          centros de acopio y sus censos asociados
+    :param data_encuesta: Lista de objetos CensoOwner o un EncuestaStream
+    :param sesion:        SesionLibros de la ejecución
+
+    :return: Generador de lotes de objetos CensoOwner
     """
+    if not donadores_por_lote:
+        yield data_encuesta
+        return
 
-    # Abrir archivo con información de censos
-    # ---------------------------------------
-    try:
-        wb = openpyxl.load_workbook(censos_filename)
-    except Exception:
-        log.error("No existe el archivo {} en el direcctorio del "
-                  "Script".format(censos_filename))
-        raise
+    # La lista de data_loader ya fue leída completa
+    if isinstance(data_encuesta, list):
+        total = sesion.filas_encuesta
+        for inicio in range(0, len(data_encuesta), donadores_por_lote):
+            lote = data_encuesta[inicio:inicio + donadores_por_lote]
+            if inicio + donadores_por_lote < len(data_encuesta):
+                sesion.filas_encuesta = lote[-1].fila
+            else:
+                sesion.filas_encuesta = total
+            yield lote
+        return
 
-    # Lista de elementos CensoOwner que presentaron error
-    lista_error = []
+    # EncuestaStream actualiza sesion.filas_encuesta al leer cada fila
+    iterador = iter(data_encuesta)
+    while True:
+        previa = sesion.filas_encuesta
+        lote = list(islice(iterador, donadores_por_lote))
+        if lote or sesion.filas_encuesta != previa:
+            yield lote
+        if len(lote) < donadores_por_lote:
+            return
 
+
+# Motor de Asignación Greedy
+# ------------------------------------------------------------------------------
+def asignar_greedy(data_encuesta, pool):
+    """
+    Asigna a cada dueño en el orden de la encuesta. Cada caja se asigna a la
+    primera opción de centro de acopio, si esta completa a la segunda y si
+    ambas estan completas queda como error
+
+    :param data_encuesta: Iterable de objetos CensoOwner
+    :param pool:          PoolCensos con las filas libres
+
+    :return: Generador de tuplas (dueño, lista de (censo, fila) asignadas).
+             Las cajas sin asignar quedan en dueño.cajas_error
+    """
     # Ciclo For principal
     # Recorre toda la lista de info en la encuesta y distribuye cada censo
     # --------------------------------------------------------------------
     for dueño in data_encuesta:
         # dueño.print_data()
 
-        # Booleano de control si el dueño fue asignado o no una caja
-        caja_asignada = False
+        # Dueños marcados con error previo (repetidos) no reciben cajas
+        if dueño.codigo_error is not None:
+            dueño.cajas_error = dueño.cajas_totales
+            yield dueño, []
+            continue
+
+        # Cantidad de cajas del dueño que no han sido asignadas
+        pendientes = dueño.cajas_totales
+        tomadas = []
 
         # Obtenga los posibles centros de acopio deseado
         lista_c_acopio = [dueño.c_acopio_1, dueño.c_acopio_2]
@@ -423,51 +2848,32 @@ def censo_spread(data_encuesta, data_censos):
         for i, c_acopio in enumerate(lista_c_acopio):
 
             log.debug("#####{}#####".format(c_acopio))
-            # For de las Fiestas asignadas al Centro de Acopio
-            for censo in data_censos[c_acopio].keys():
-
-                log.debug("----{}----".format(censo))
-                cant_familias = len(data_censos[c_acopio][censo])
-
-                # Si no quedan familias en el censo seguir al siguiente
-                if cant_familias == 0:
-                    log.debug("No more Boxes")
-                    continue
-                # Si quedan, asignar la primera en al lista al dueño
-                else:
-                    # Fila a escribir
-                    # Se elimina el número a asignar de la lista del censo
-                    row = data_censos[c_acopio][censo].pop(0)
-                    log.debug("Caja fila: {}, de {}, fue asignada a {}".format(
-                        row, censo, dueño.nombre))
-
-                    # Escribe la información del nuevo Dueño
-                    wb[censo][columna_dueño+str(row+1)] = dueño.nombre
-                    wb[censo][columna_dueño+str(row+2)] = dueño.telefono
-
-                    # Booleano de caja asignada a True
-                    caja_asignada = True
-
-                    # La caja fue asignada se puede salir del ciclo For
-                    break
-
-            # Si la caja fue asignada se puede seguir con el siguiente dueño
-            if caja_asignada:
-
-                # Impresion de Mensaje de Usuario en caso de que se usara
-                # la segunda opción de Sector de Entrega
-                if i == 1:
-                    log.info("Para el dueño de nombre {} y telefono {} se tuvo"
-                             "que elegir su segunda opción de sector de "
-                             "entrega: {}".format(dueño.nombre,
-                                                  dueño.telefono,
-                                                  dueño.c_acopio_2))
-
+            # Primeras filas libres de las Fiestas asignadas al Centro de
+            # Acopio, se toman todas las cajas pendientes en un solo paso
+            asignadas = pool.tomar(c_acopio, pendientes)
+            pendientes -= len(asignadas)
+            tomadas.extend(asignadas)
+            metricas.sumar(("primera_opcion", "segunda_opcion")[i],
+                           len(asignadas))
+
+            # Impresion de Mensaje de Usuario en caso de que se usara
+            # la segunda opción de Sector de Entrega
+            if asignadas and i == 1:
+                log.info("Para el dueño de nombre {} y telefono {} se tuvo"
+                         "que elegir su segunda opción de sector de "
+                         "entrega: {} ({} cajas)".format(dueño.nombre,
+                                                         dueño.telefono,
+                                                         dueño.c_acopio_2,
+                                                         len(asignadas)))
+
+            # Si todas las cajas fueron asignadas se puede seguir con el
+            # siguiente dueño
+            if pendientes == 0:
                 break
 
             # En caso de que un Sector de Entrega este completo, se le presenta
             # el mensaje al usuario
-            if not dict_centros_de_acopio_full_status[c_acopio]:
+            if not dict_centros_de_acopio_full_status.get(c_acopio):
                 dict_centros_de_acopio_full_status[c_acopio] = True
                 log.info("Sector: {} ha entregado todas sus cajas".format(
                     c_acopio))
@@ -478,63 +2884,406 @@ def censo_spread(data_encuesta, data_censos):
                 log.error("Crisis 1: Para el dueño {} telefono {}".format(
                     dueño.nombre, dueño.telefono))
                 dueño.codigo_error = error_repetición
-                lista_error.append(dueño)
                 break
 
-        # Chequea si el dueño posee una caja asignada
-        if not caja_asignada and dueño.codigo_error is None:
-            log.error("Crisis 2: Para el dueño {} telefono {}".format(
-                dueño.nombre, dueño.telefono))
-            dueño.codigo_error = error_distribución
-            lista_error.append(dueño)
+        # Chequea si el dueño posee cajas sin asignar
+        if pendientes > 0:
+            if dueño.codigo_error is None:
+                log.error("Crisis 2: Para el dueño {} telefono {}".format(
+                    dueño.nombre, dueño.telefono))
+                dueño.codigo_error = error_distribución
+            dueño.cajas_error = pendientes
+
+        yield dueño, tomadas
+
+
+# Motor de Asignación por Flujo de Costo Mínimo
+# ------------------------------------------------------------------------------
+def flujo_costo_minimo(cant_nodos, aristas, fuente, sumidero):
+    """
+    Flujo máximo de costo mínimo por caminos más cortos sucesivos
+    (Bellman-Ford). Pensado para grafos pequeños: los nodos son tipos de
+    dueño y centros de acopio, no cajas
+
+    :param cant_nodos: Cantidad de nodos, numerados desde 0
+    :param aristas:    Lista de tuplas (origen, destino, capacidad, costo)
+    :param fuente:     Nodo fuente
+    :param sumidero:   Nodo sumidero
+
+    :return: Lista con el flujo de cada arista, en el orden de aristas
+    """
+    # Grafo residual, cada arista guarda [destino, capacidad, costo, reversa]
+    grafo = [[] for _ in range(cant_nodos)]
+    ubicacion = []
+    for origen, destino, capacidad, costo in aristas:
+        ubicacion.append((origen, len(grafo[origen])))
+        grafo[origen].append([destino, capacidad, costo,
+                              len(grafo[destino])])
+        grafo[destino].append([origen, 0, -costo, len(grafo[origen]) - 1])
+
+    while True:
+        # Camino de menor costo con capacidad disponible (Bellman-Ford con
+        # cola, solo se revisan los nodos cuya distancia cambio)
+        distancia = [None] * cant_nodos
+        previo = [None] * cant_nodos
+        en_cola = [False] * cant_nodos
+        distancia[fuente] = 0
+        cola = deque([fuente])
+        while cola:
+            nodo = cola.popleft()
+            en_cola[nodo] = False
+            for i, (destino, capacidad, costo, _) in enumerate(grafo[nodo]):
+                nueva = distancia[nodo] + costo
+                if capacidad > 0 and (distancia[destino] is None or
+                                      nueva < distancia[destino]):
+                    distancia[destino] = nueva
+                    previo[destino] = (nodo, i)
+                    if not en_cola[destino]:
+                        en_cola[destino] = True
+                        cola.append(destino)
+
+        if distancia[sumidero] is None:
+            break
+
+        # Capacidad del camino encontrado
+        aumento = None
+        nodo = sumidero
+        while nodo != fuente:
+            anterior, i = previo[nodo]
+            capacidad = grafo[anterior][i][1]
+            aumento = capacidad if aumento is None else min(aumento, capacidad)
+            nodo = anterior
+
+        nodo = sumidero
+        while nodo != fuente:
+            anterior, i = previo[nodo]
+            arista = grafo[anterior][i]
+            arista[1] -= aumento
+            grafo[nodo][arista[3]][1] += aumento
+            nodo = anterior
+
+    # Flujo de cada arista = capacidad de su reversa en el grafo residual
+    return [grafo[grafo[origen][i][0]][grafo[origen][i][3]][1]
+            for origen, i in ubicacion]
+
+
+def asignar_flujo(data_encuesta, pool):
+    """
+    Asigna todo el lote de dueños a la vez como un flujo de costo mínimo.
+    Los dueños se agrupan por su par (primera opción, segunda opción) y cada
+    centro de acopio aporta sus filas libres como capacidad. Asignar en la
+    primera opción cuesta 1 y en la segunda 2, de forma que se maximiza la
+    cantidad de cajas asignadas y luego las asignadas en primera opción
+
+    Dentro de un mismo grupo los dueños se atienden en el orden de la encuesta
+
+    :param data_encuesta: Iterable de objetos CensoOwner
+    :param pool:          PoolCensos con las filas libres
+
+    :return: Generador de tuplas (dueño, lista de (censo, fila) asignadas).
+             Las cajas sin asignar quedan en dueño.cajas_error
+    """
+    dueños = list(data_encuesta)
+
+    # Demanda de cajas de cada grupo de dueños, los dueños marcados con error
+    # previo (repetidos) no reciben cajas
+    demanda = {}
+    for dueño in dueños:
+        if dueño.codigo_error is not None:
+            continue
+        grupo = (dueño.c_acopio_1, dueño.c_acopio_2)
+        demanda[grupo] = demanda.get(grupo, 0) + dueño.cajas_totales
+
+    # Nodos: fuente, grupos, centros de acopio y sumidero
+    centros = list(pool.censos)
+    grupos = list(demanda)
+    fuente = 0
+    nodo_grupo = {grupo: 1 + i for i, grupo in enumerate(grupos)}
+    nodo_centro = {c_acopio: 1 + len(grupos) + i
+                   for i, c_acopio in enumerate(centros)}
+    sumidero = 1 + len(grupos) + len(centros)
+
+    aristas = []
+    opciones = []
+    for grupo in grupos:
+        aristas.append((fuente, nodo_grupo[grupo], demanda[grupo], 0))
+        for costo, c_acopio in enumerate(grupo, start=1):
+            # Centro de acopio repetido solo tiene una opción
+            if costo == 2 and c_acopio == grupo[0]:
+                continue
+            opciones.append((grupo, costo, c_acopio, len(aristas)))
+            aristas.append((nodo_grupo[grupo], nodo_centro[c_acopio],
+                            demanda[grupo], costo))
+    for c_acopio in centros:
+        aristas.append((nodo_centro[c_acopio], sumidero,
+                        pool.disponibles(c_acopio), 0))
+
+    flujo = flujo_costo_minimo(sumidero + 1, aristas, fuente, sumidero)
+
+    # Cajas de cada grupo asignadas a su primera y segunda opción
+    cupo = {grupo: [0, 0] for grupo in grupos}
+    for grupo, costo, c_acopio, i in opciones:
+        cupo[grupo][costo - 1] = flujo[i]
+
+    # Reparto del cupo de cada grupo en el orden de la encuesta
+    for dueño in dueños:
+        if dueño.codigo_error is not None:
+            dueño.cajas_error = dueño.cajas_totales
+            yield dueño, []
+            continue
+
+        cupo_grupo = cupo[(dueño.c_acopio_1, dueño.c_acopio_2)]
+        pendientes = dueño.cajas_totales
+        tomadas = []
+
+        for i, c_acopio in enumerate([dueño.c_acopio_1, dueño.c_acopio_2]):
+            cantidad = min(pendientes, cupo_grupo[i])
+            if cantidad == 0:
+                continue
+            cupo_grupo[i] -= cantidad
+            pendientes -= cantidad
+            tomadas.extend(pool.tomar(c_acopio, cantidad))
+            metricas.sumar(("primera_opcion", "segunda_opcion")[i], cantidad)
+
+            # Impresion de Mensaje de Usuario en caso de que se usara
+            # la segunda opción de Sector de Entrega
+            if i == 1:
+                log.info("Para el dueño de nombre {} y telefono {} se tuvo"
+                         "que elegir su segunda opción de sector de "
+                         "entrega: {} ({} cajas)".format(dueño.nombre,
+                                                         dueño.telefono,
+                                                         dueño.c_acopio_2,
+                                                         cantidad))
+
+        if pendientes > 0:
+            if dueño.c_acopio_repetido:
+                # CRISIS 1
+                log.error("Crisis 1: Para el dueño {} telefono {}".format(
+                    dueño.nombre, dueño.telefono))
+                dueño.codigo_error = error_repetición
+            else:
+                log.error("Crisis 2: Para el dueño {} telefono {}".format(
+                    dueño.nombre, dueño.telefono))
+                dueño.codigo_error = error_distribución
+            dueño.cajas_error = pendientes
+
+        yield dueño, tomadas
+
+    # En caso de que un Sector de Entrega este completo, se le presenta
+    # el mensaje al usuario
+    for c_acopio in centros:
+        if pool.disponibles(c_acopio) == 0 and \
+           not dict_centros_de_acopio_full_status.get(c_acopio):
+            dict_centros_de_acopio_full_status[c_acopio] = True
+            log.info("Sector: {} ha entregado todas sus cajas".format(
+                c_acopio))
+
+
+# Parser de Excel de Censos
+# ------------------------------------------------------------------------------
+def ejecutar_motor(data_encuesta, pool, motor=None):
+    """
+    :param data_encuesta: Iterable de objetos CensoOwner
+    :param pool:          PoolCensos con las filas libres
+    :param motor:         Nombre del motor, por defecto motor_asignacion
+
+    :return: Generador de tuplas (dueño, lista de (censo, fila) asignadas)
+             del motor de asignación
+    """
+    motor = motor or motor_asignacion
+    if motor == "flujo":
+        return asignar_flujo(data_encuesta, pool)
+    return asignar_greedy(data_encuesta, pool)
+
+
+def censo_spread(data_encuesta, data_censos, sesion=None, guardar=True):
+    """
+    Algoritmo principal de distribución de cajas. Asocia a cada posible dueño
+    con un censo. Modifica el archivo de censos extensión .xlsx con el nombre
+    y número de teléfono del encargado
+
+    :param data_encuesta: Lista de objetos CensoOwner con informacion de los
+                          posibles dueños de censos, o un EncuestaStream que
+                          los genera directamente del .csv
+    :param data_censos:   Diccionario de diccionarios con informacion de los
+                          centros de acopio y sus censos asociados, o un
+                          PoolCensos construido a partir de este
+    :param sesion:        SesionLibros de la ejecución con el libro de censos
+    :param guardar:       Si es False las asignaciones quedan pendientes en la
+                          sesión hasta llamar a guardar_distribucion
+    """
+
+    # Libro con información de censos
+    # -------------------------------
+    sesion = sesion or nueva_sesion()
+
+    # Filas libres de cada centro de acopio
+    if isinstance(data_censos, PoolCensos):
+        pool = data_censos
+    else:
+        pool = PoolCensos(data_censos)
+
+    # Lista de elementos CensoOwner que presentaron error
+    lista_error = []
+
+    # Diario de asignaciones, las cajas registradas por una ejecución
+    # interrumpida no se vuelven a asignar
+    if sesion.diario is None:
+        sesion.diario = DiarioAsignaciones(diario_filename,
+                                           sesion.contadores()[0])
+        pool.retirar(sesion.diario.tomadas())
+    diario = sesion.diario
+
+    # Solicitudes repetidas
+    if detectar_repetidos:
+        if sesion.donadores is None:
+            sesion.donadores = IndiceDonadores.cargar(sesion)
+        data_encuesta = sesion.donadores.marcar(data_encuesta)
+
+    data_encuesta = diario.reanudar(data_encuesta)
+
+    # Motor de asignación
+    asignaciones = ejecutar_motor(data_encuesta, pool)
+
+    # El libro de censos se carga antes de medir la asignación, de forma que
+    # asignaciones_por_segundo no incluya la etapa carga_libro
+    if modo_estado == "xlsx" and modo_escritura == "xlsx":
+        sesion.wb
+
+    # Ciclo For principal
+    # Escribe la información de cada dueño en los censos asignados
+    # --------------------------------------------------------------------
+    with metricas.etapa("asignacion"):
+        for dueño, asignadas in asignaciones:
+            # Cajas nuevas del dueño al diario, numeradas después de las
+            # registradas por una ejecución interrumpida
+            previas = diario.previas.get(dueño.fila, [])
+            caja = len(previas)
+            for censo, row in asignadas:
+                diario.registrar(dueño.fila, caja, censo, row)
+                caja += 1
+            for caja in range(caja, caja + dueño.cajas_error):
+                diario.registrar(dueño.fila, caja, None, dueño.codigo_error)
+
+            # Cajas del dueño registradas en el diario
+            for fila, caja, censo, valor in previas:
+                if censo is None:
+                    dueño.cajas_error += 1
+                    if dueño.codigo_error is None:
+                        dueño.codigo_error = valor
+            asignadas = [(censo, valor) for fila, caja, censo, valor
+                         in previas if censo is not None] + asignadas
+
+            # Solo los dueños que recibieron cajas quedan registrados
+            if sesion.donadores is not None and asignadas:
+                sesion.donadores.registrar(dueño)
+
+            metricas.sumar("donadores")
+            metricas.sumar("asignaciones", len(asignadas))
+            for censo, row in asignadas:
+                log.debug("Caja fila: {}, de {}, fue asignada a {}".format(
+                    row, censo, dueño.nombre))
+
+                # Escribe la información del nuevo Dueño
+                sesion.asignar(censo, row, dueño)
+
+            if dueño.cajas_error > 0:
+                lista_error.append(dueño)
+                metricas.sumar("crisis", dueño.cajas_error,
+                               clave=dueño.codigo_error)
 
     # Posterior a la Distribución
     # ---------------------------
     # Resolución de casos de error
-    errores_existentes = wb[hoja_error].max_row
-    log.debug("Errores Existentes: {}".format(errores_existentes))
-    for i, error in enumerate(lista_error):
+    for error in lista_error:
         # error.print_data()
 
-        # Se escribe la información de Error en la Hoja Crisis
-        wb[hoja_error][columna_nombre+str(errores_existentes+i+1)] = \
-            error.nombre
-        wb[hoja_error][columna_telefono+str(errores_existentes+i+1)] = \
-            error.telefono
-        wb[hoja_error][columna_c_acopio_1+str(errores_existentes+i+1)] = \
-            error.c_acopio_1
-        wb[hoja_error][columna_c_acopio_2+str(errores_existentes+i+1)] = \
-            error.c_acopio_2
-        wb[hoja_error][columna_cant_cajas+str(errores_existentes+i+1)] = \
-            error.cant_cajas
-        wb[hoja_error][columna_error+str(errores_existentes+i+1)] = \
-            msj_error[error.codigo_error]
+        # Se escribe la información de Error en la Hoja Crisis, una fila
+        # por cada caja sin asignar
+        for caja in range(error.cajas_error):
+            sesion.agregar_error(error)
 
-    # Log del estado de los censos post distirbución
-    for centro_de_acopio in data_censos.keys():
+    if guardar:
+        guardar_distribucion(sesion, pool)
 
-        # Ciclo for para cada Censo dentro del Centro de Acopio Actual
-        for censo in data_censos[centro_de_acopio].keys():
-            log.info("Censo {} de Sector {} posee {} sin distribuir".format(
-                censo,
-                centro_de_acopio,
-                len(data_censos[centro_de_acopio][censo])))
+
+# Guardado de la Distribución
+# ------------------------------------------------------------------------------
+def guardar_distribucion(sesion, pool):
+    """
+    Escribe el contador de hoja_data_delicada y guarda el libro de censos con
+    las asignaciones pendientes de la sesión
+
+    :param sesion: SesionLibros de la ejecución con el libro de censos
+    :param pool:   PoolCensos con las filas libres posteriores a la
+                   distribución
+    """
+    # Log del estado de los censos post distirbución
+    for centro_de_acopio, censo, cant_familias in pool.restantes():
+        log.info("Censo {} de Sector {} posee {} sin distribuir".format(
+            censo, centro_de_acopio, cant_familias))
+    for censo, ocupacion in pool.ocupacion().items():
+        metricas.fijar("ocupacion_censos", round(ocupacion, 4), clave=censo)
 
     # Nota de la última fila de encuesta
-    wb_encuesta = openpyxl.load_workbook(encuesta_filename)
-    data_sheet = wb_encuesta.active
-    for celda in lista_celdas:
-        wb[hoja_data_delicada][celda].value = data_sheet.max_row
+    if sesion.filas_encuesta is None:
+        sesion.hoja_encuesta()
+    sesion.escribir_contador(sesion.filas_encuesta)
 
     # Escritura final del archivo
     # ---------------------------
-    wb.save(resultados_filename)
+    if sesion.diario is not None:
+        sesion.diario.escribir()
+    sesion.guardar()
+    if sesion.diario is not None:
+        sesion.diario.vaciar()
+        sesion.diario = None
+    if sesion.donadores is not None:
+        sesion.donadores.guardar(sesion.filas_encuesta)
+    if modo_estado == "xlsx":
+        guardar_indice_censos(pool)
 
 
 ###############################################################################
 #                                   SETUP                                     #
 ###############################################################################
 def setup():
+    # Argumentos de Línea de Comandos
+    # --------------------------------------------------------------------------
+    parser = argparse.ArgumentParser(
+        description="Distribución de censos con sus donantes respectivos")
+    parser.add_argument("--metricas", metavar="ARCHIVO",
+                        help="Guarda las métricas de la ejecución (tiempo por "
+                             "etapa, filas leídas, asignaciones y crisis) en "
+                             "un archivo .json")
+    parser.add_argument("--fusionar", action="store_true",
+                        help="Fusiona los cambios pendientes de "
+                             "cambios_filename en el libro de censos y "
+                             "termina")
+    parser.add_argument("--exportar", action="store_true",
+                        help="Genera resultados_filename a partir de la base "
+                             "estado_filename (modo_estado \"sqlite\") y "
+                             "termina")
+    parser.add_argument("--vigilar", action="store_true",
+                        help="Modo de vigilancia: asigna los registros que "
+                             "se agregan a csv_orig_filename hasta ser "
+                             "detenido con Ctrl+C")
+    parser.add_argument("--campañas", metavar="ARCHIVO",
+                        help="Ejecuta a la vez las campañas de un archivo "
+                             ".json (lista de configuraciones con \"nombre\", "
+                             "\"directorio\" y variables globales) y guarda "
+                             "el resumen en resumen_campañas_filename")
+    parser.add_argument("--simular", metavar="ARCHIVO",
+                        help="Simula en memoria los escenarios de un archivo "
+                             ".json (lista de parámetros de "
+                             "Simulacion.simular) sin modificar los libros y "
+                             "guarda los resultados en "
+                             "resultados_simulacion_filename")
+    parser.add_argument("--perfil", metavar="ARCHIVO",
+                        help="Ejecuta con cProfile y guarda las estadísticas "
+                             "en ARCHIVO (ver python -m pstats)")
+    args = parser.parse_args()
+
     # Log Format Setup
     # --------------------------------------------------------------------------
     try:
@@ -564,52 +3313,382 @@ def setup():
 
     log.info('Verbosity at level {}'.format(level))
 
+    return args
+
 
 ###############################################################################
 #                                MAIN SCRIPT                                  #
 ###############################################################################
-def main():
-    # Convertir archivo .csv a .xlsx
-    conv_to_xlsx(csv_orig_filename)
+def main(args=None):
+    global metricas
+    metricas = Metricas()
+
+    # Perfilado opcional de toda la ejecución
+    perfil = None
+    if args is not None and args.perfil:
+        perfil = cProfile.Profile()
+        perfil.enable()
 
-    # Sanity Check
-    # Se obtiene cantidad de lineas de encuesta previamente leidas
     try:
-        wb = openpyxl.load_workbook(censos_filename)
-    except Exception:
-        log.error("No existe el archivo {} en el direcctorio del "
-                  "Script".format(censos_filename))
-        raise
+        with metricas.etapa("total"):
+            if args is not None and args.fusionar:
+                fusionar_cambios()
+                return
+
+            if args is not None and args.exportar:
+                with SesionSQLite() as sesion:
+                    sesion.exportar()
+                log.info("Estado de {} exportado a {}".format(
+                    estado_filename, resultados_filename))
+                return
+
+            if args is not None and args.simular:
+                with open(args.simular, encoding='utf-8') as arch_escenarios:
+                    escenarios = json.load(arch_escenarios)
+                with metricas.etapa("simulacion"):
+                    resultados = Simulacion().escenarios(escenarios)
+                guardar_json(resultados_simulacion_filename, resultados)
+                log.info("{} escenarios simulados, resultados en {}".format(
+                    len(resultados), resultados_simulacion_filename))
+                return
+
+            if args is not None and args.campañas:
+                with open(args.campañas, encoding='utf-8') as arch_campañas:
+                    ejecutar_campañas(json.load(arch_campañas))
+                return
+
+            if args is not None and args.vigilar:
+                with nueva_sesion() as sesion:
+                    vigilar(sesion)
+                return
+
+            # Chequeo rápido: la encuesta y los libros no cambiaron desde la
+            # última ejecución
+            if sin_cambios():
+                log.info("No hay nuevos dueños que asignar")
+                return
+            encuesta = estado_archivo(csv_orig_filename)
+
+            # Convertir archivo .csv a .xlsx
+            if modo_ingesta == "xlsx":
+                with metricas.etapa("conv_to_xlsx"):
+                    conv_to_xlsx(csv_orig_filename)
+
+            with nueva_sesion() as sesion:
+                if distribuir(sesion):
+                    guardar_sello(encuesta)
+    finally:
+        if perfil is not None:
+            perfil.disable()
+            perfil.dump_stats(args.perfil)
+            log.info("Perfil guardado en {}".format(args.perfil))
+
+        if args is not None and args.metricas:
+            metricas.guardar(args.metricas)
+            log.info("Métricas guardadas en {}".format(args.metricas))
+
+
+def fusionar_cambios():
+    """
+    Escribe los cambios pendientes de cambios_filename en el libro de censos
+    y los guarda en resultados_filename
+    """
+    with SesionLibros() as sesion:
+        if not sesion.cambios.celdas:
+            log.info("No hay cambios pendientes en {}".format(
+                cambios_filename))
+            return
+
+        # Al cargar el libro se aplican los cambios pendientes
+        if modo_escritura != "hojas" or \
+           not escribir_hojas(sesion.cambios.celdas):
+            sesion.wb.save(resultados_filename)
+        sesion.cambios.vaciar()
+        log.info("Cambios de {} fusionados en {}".format(
+            cambios_filename, resultados_filename))
 
-    ultima_fila = wb[hoja_data_delicada][lista_celdas[0]].value
+
+def leer_contador(sesion):
+    """
+    Sanity Check del contador de hoja_data_delicada
+
+    :param sesion: SesionLibros de la ejecución
+
+    :return: Cantidad de lineas de encuesta previamente leidas o None si las
+             celdas de lista_celdas no coinciden
+    """
+    contadores = sesion.contadores()
+    ultima_fila = contadores[0]
     log.info("Ultima Fila distribuida: {}".format(ultima_fila))
-    for celda in lista_celdas:
-        if ultima_fila != wb[hoja_data_delicada][celda].value:
+    for contador in contadores:
+        if ultima_fila != contador:
             log.critical("CORRUPCION EN HOJA {}".format(hoja_data_delicada))
-            return
+            return None
+    return ultima_fila
 
-    # Parsear datos de encuesta
-    parsed_data = data_loader(ultima_fila)
+
+def distribuir(sesion):
     """
-    for member in parsed_data:
-        member.print_data()
+    Ejecuta las etapas de distribución compartiendo los libros de la sesión
+
+    :param sesion: SesionLibros de la ejecución
+
+    :return: True si la distribución finalizó, False si se detuvo por
+             corrupción en hoja_data_delicada
     """
-    log.debug("Parsed data length: ", len(parsed_data))
+    # Sanity Check
+    # Se obtiene cantidad de lineas de encuesta previamente leidas
+    ultima_fila = leer_contador(sesion)
+    if ultima_fila is None:
+        return False
+
+    # Parsear datos de encuesta
+    if modo_ingesta == "stream":
+        parsed_data = EncuestaStream(csv_orig_filename, ultima_fila, sesion)
+        hay_nuevos = parsed_data.hay_nuevos()
+    elif modo_ingesta == "columnas":
+        with metricas.etapa("data_loader"):
+            parsed_data = leer_encuesta_columnas(csv_orig_filename,
+                                                 ultima_fila, sesion)
+        hay_nuevos = len(parsed_data) > 0
+    else:
+        with metricas.etapa("data_loader"):
+            parsed_data = data_loader(ultima_fila, sesion)
+        """
+        for member in parsed_data:
+            member.print_data()
+        """
+        log.debug("Parsed data length: {}".format(len(parsed_data)))
+        hay_nuevos = len(parsed_data) > 0
 
     # Asegurar que hay nuevos dueños que asignar
-    if len(parsed_data) == 0:
+    if not hay_nuevos:
         log.info("No hay nuevos dueños que asignar")
-        return
+        return True
 
     # Parsear datos de censos
-    parsed_censos = censos_loader()
+    with metricas.etapa("censos_loader"):
+        parsed_censos = censos_loader(sesion)
     log.debug(parsed_censos)
     log.debug(dict_centros_de_acopio)
 
     # Algoritmo de distribución principal
-    censo_spread(data_encuesta=parsed_data, data_censos=parsed_censos)
+    # En modo "stream" incluye la lectura de la encuesta. Los lotes comparten
+    # las filas libres y cada uno guarda el libro al finalizar
+    with metricas.etapa("censo_spread"):
+        pool = PoolCensos(parsed_censos)
+        for lote in lotes_encuesta(parsed_data, sesion):
+            censo_spread(data_encuesta=lote, data_censos=pool, sesion=sesion)
 
     log.info("Script finalizado")
+    return True
+
+
+def vigilar(sesion):
+    """
+    Modo de vigilancia. Mantiene en memoria el libro de censos y las filas
+    libres, y revisa cada intervalo_sondeo segundos si se agregaron registros
+    a csv_orig_filename. Los donadores nuevos se asignan de inmediato y el
+    libro se guarda como máximo cada intervalo_guardado segundos. Termina
+    con Ctrl+C, guardando las asignaciones pendientes
+
+    :param sesion: SesionLibros de la ejecución
+    """
+    ultima_fila = leer_contador(sesion)
+    if ultima_fila is None:
+        return
+
+    with metricas.etapa("censos_loader"):
+        pool = PoolCensos(censos_loader(sesion))
+    if modo_estado == "xlsx" and modo_escritura == "xlsx":
+        sesion.wb
+
+    # Solo se leen líneas completas, el formulario puede estar escribiendo
+    stream = EncuestaStream(csv_orig_filename, ultima_fila, sesion,
+                            completas=True)
+    log.info("Vigilando {}".format(csv_orig_filename))
+
+    pendientes = False
+    ultimo_guardado = time.monotonic()
+    tamaño_previo = None
+    try:
+        while True:
+            # Una última línea sin salto de línea se acepta cuando el archivo
+            # no creció durante un intervalo completo
+            tamaño = os.path.getsize(csv_orig_filename)
+            stream.completas = tamaño != tamaño_previo
+            tamaño_previo = tamaño
+
+            if stream.hay_nuevos():
+                fila = stream.fila
+                # Punto de la última fila entregada a censo_spread
+                punto = stream.fila, stream.offset, sesion.filas_encuesta
+                with metricas.etapa("censo_spread"):
+                    try:
+                        nuevos = list(stream)
+                    except Exception:
+                        # El lote no se distribuyó, el contador y el cursor
+                        # que se guardan al terminar no deben incluirlo
+                        stream.fila, stream.offset, sesion.filas_encuesta = \
+                            punto
+                        raise
+                    censo_spread(nuevos, pool, sesion, guardar=False)
+                if stream.fila != fila:
+                    log.info("{} donadores nuevos hasta la fila {}".format(
+                        len(nuevos), stream.fila))
+                    pendientes = True
+
+            if pendientes and \
+               time.monotonic() - ultimo_guardado >= intervalo_guardado:
+                guardar_distribucion(sesion, pool)
+                pendientes = False
+                ultimo_guardado = time.monotonic()
+
+            time.sleep(intervalo_sondeo)
+    except KeyboardInterrupt:
+        log.info("Vigilancia detenida")
+    finally:
+        if pendientes:
+            guardar_distribucion(sesion, pool)
+
+
+# Varias Campañas
+# ------------------------------------------------------------------------------
+def ejecutar_campaña(campaña):
+    """
+    Ejecuta la distribución de una campaña. Las variables globales indicadas
+    por la campaña reemplazan las del script mientras dura la ejecución y se
+    restauran al terminar, un mismo proceso puede ejecutar varias campañas
+
+    :param campaña: Diccionario con la configuración de la campaña:
+                    "nombre":     Nombre usado en el resumen
+                    "directorio": Directorio donde se encuentran los archivos
+                                  de la campaña (opcional)
+                    Cualquier otra llave es el nombre de una variable de
+                    variables_configuracion y su valor. En
+                    dict_centros_de_acopio las hojas de cada centro pueden
+                    indicarse como una lista de nombres
+
+    :return: Diccionario con el nombre, el reporte de métricas y el error de
+             la campaña (None si terminó correctamente)
+    """
+    variables = {llave: valor for llave, valor in campaña.items()
+                 if llave not in ("nombre", "directorio")}
+    nombre = campaña.get("nombre", campaña.get("directorio", "campaña"))
+
+    desconocidas = [llave for llave in variables
+                    if llave not in variables_configuracion]
+    if desconocidas:
+        error = "Variables globales desconocidas o no configurables: " \
+                "{}".format(", ".join(desconocidas))
+        log.error("Campaña {} no ejecutada. {}".format(nombre, error))
+        return {"nombre": nombre, "metricas": Metricas().reporte(),
+                "error": error}
+
+    centros = variables.get("dict_centros_de_acopio")
+    if centros is not None:
+        variables["dict_centros_de_acopio"] = {
+            c_acopio: {censo: [] for censo in censos}
+            for c_acopio, censos in centros.items()}
+        variables.setdefault("dict_centros_de_acopio_full_status",
+                             {c_acopio: False for c_acopio in centros})
+
+    # Estado previo, incluye los diccionarios que el script modifica y las
+    # métricas que main reinicia
+    previas = {llave: deepcopy(globals()[llave]) for llave in
+               set(variables) | {"dict_centros_de_acopio",
+                                 "dict_centros_de_acopio_full_status"}}
+    previas["metricas"] = metricas
+    directorio = os.getcwd()
+    try:
+        globals().update(deepcopy(variables))
+        os.chdir(campaña.get("directorio", directorio))
+        log.info("Campaña {} iniciada".format(nombre))
+        main()
+        error = None
+    except Exception as e:
+        log.exception("Campaña {} fallo".format(nombre))
+        error = "{}: {}".format(type(e).__name__, e)
+    finally:
+        reporte = metricas.reporte()
+        os.chdir(directorio)
+        globals().update(previas)
+
+    return {"nombre": nombre, "metricas": reporte, "error": error}
+
+
+def resumen_campañas(resultados, segundos):
+    """
+    Combina los resultados de ejecutar_campaña
+
+    :param resultados: Lista con el resultado de cada campaña
+    :param segundos:   Tiempo de pared de todas las campañas
+
+    :return: Diccionario serializable a .json con los resultados, la suma de
+             los contadores y las cajas en crisis por código de error
+    """
+    totales = {}
+    crisis = {}
+    for resultado in resultados:
+        for contador, valor in resultado["metricas"]["contadores"].items():
+            # La ocupación es una proporción por censo, no se suma
+            if contador == "ocupacion_censos":
+                continue
+            if isinstance(valor, dict):
+                total = totales.setdefault(contador, {})
+                for clave, cantidad in valor.items():
+                    total[clave] = total.get(clave, 0) + cantidad
+            else:
+                totales[contador] = totales.get(contador, 0) + valor
+
+        for codigo, cajas in resultado["metricas"]["contadores"].get(
+                "crisis", {}).items():
+            resumen = crisis.setdefault(codigo, {
+                "mensaje": msj_error[int(codigo)], "cajas": 0,
+                "campañas": {}})
+            resumen["cajas"] += cajas
+            resumen["campañas"][resultado["nombre"]] = cajas
+
+    return {"segundos": round(segundos, 6),
+            "campañas": resultados,
+            "errores": [resultado["nombre"] for resultado in resultados
+                        if resultado["error"] is not None],
+            "contadores": totales,
+            "crisis": crisis}
+
+
+def ejecutar_campañas(campañas):
+    """
+    Ejecuta varias campañas a la vez en un pool de procesos y guarda el
+    resumen combinado en resumen_campañas_filename
+
+    :param campañas: Lista de configuraciones (ver ejecutar_campaña)
+
+    :return: Diccionario de resumen_campañas
+    """
+    procesos = min(procesos_campañas or os.cpu_count() or 1, len(campañas))
+    inicio = time.perf_counter()
+    if procesos <= 1:
+        resultados = list(map(ejecutar_campaña, campañas))
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=procesos) as ejecutor:
+            # map conserva el orden de las campañas
+            resultados = list(ejecutor.map(ejecutar_campaña, campañas))
+
+    resumen = resumen_campañas(resultados, time.perf_counter() - inicio)
+    guardar_json(resumen_campañas_filename, resumen)
+
+    log.info("{} campañas ejecutadas en {:.2f} s con {} procesos, {} "
+             "asignaciones, {} cajas en crisis".format(
+                len(campañas), resumen["segundos"], procesos,
+                resumen["contadores"].get("asignaciones", 0),
+                sum(resumen["contadores"].get("crisis", {}).values())))
+    for nombre in resumen["errores"]:
+        log.error("Campaña {} no finalizo, ver {}".format(
+            nombre, resumen_campañas_filename))
+    return resumen
 
 
 ###############################################################################
@@ -617,4 +3696,4 @@ def main():
 ###############################################################################
 if __name__ == '__main__':
     args = setup()
-    main()
+    main(args)
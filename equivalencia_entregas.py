@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Para uso único de los proyectos de Solidaridad en Marcha o
+# procesos de aprendizaje autorizados por el mismo ente
+#
+# Creador: Rodolfo Piedra Camacho
+# Contacto: fofo.piedra@gmail.com
+#
+
+"""
+Pruebas de equivalencia de los modos y motores de distribuidor_entregas
+
+Ejecuta la distribución de referencia y cada variante sobre copias de las
+mismas entradas, y compara celda por celda los resultados. La referencia es
+distribuidor_entregas_original, copia sin cambios de la versión de
+distribuidor_entregas anterior a las optimizaciones. La variante "actual"
+ejecuta la versión vigente con sus variables globales por defecto. Se
+comparan:
+ - Columna columna_dueño de cada hoja de censos (nombres y teléfonos)
+ - Filas de hoja_error
+ - Celdas lista_celdas de hoja_data_delicada
+
+Las entradas son la encuesta y el libro limpio del repositorio
+(Entregas NEJ 2018_Copia.xlsx) o casos sintéticos generados con
+benchmark_entregas (opción --cajas). Por cada ejecución se reporta el tiempo
+y el pico de memoria. El script termina con código 1 si alguna variante
+difiere de la referencia
+
+Con --dorado se compara además la referencia con Entregas NEJ 2018_DONE.xlsx.
+Ese libro se generó con una exportación anterior de la encuesta, la
+comparación es solo informativa
+
+Ejemplo:
+    python3 equivalencia_entregas.py --cajas 500 20000 --salida eq.json
+"""
+###############################################################################
+#                                  IMPORTS                                    #
+###############################################################################
+import argparse
+import io
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+from contextlib import redirect_stdout
+from copy import deepcopy
+
+import openpyxl
+
+import benchmark_entregas as bench
+import distribuidor_entregas as de
+import distribuidor_entregas_original as original
+
+###############################################################################
+#                                  GLOBAL                                    #
+###############################################################################
+# Variable de Log para documentar errores de ejecución
+log = logging.getLogger(__name__)
+
+# Directorio con los archivos de ejemplo del repositorio
+directorio_repo = os.path.dirname(os.path.abspath(__file__))
+
+# Libro de censos limpio y libro de resultados de referencia del repositorio
+censos_limpio_filename = "Entregas NEJ 2018_Copia.xlsx"
+dorado_filename = "Entregas NEJ 2018_DONE.xlsx"
+
+# Variantes comparadas con la referencia
+# Cada variante es una tupla (variables globales, paso posterior). Pasos:
+# None:        Solo se ejecuta main
+# "fusionar":  Se fusionan los cambios pendientes (modo_escritura "cambios")
+# "exportar":  Se exporta la base de estado (modo_estado "sqlite")
+# "mitades":   main se ejecuta con la primera mitad de la encuesta y de nuevo
+#              con la encuesta completa
+variantes = {"actual":      ({}, None),
+             "stream":      ({"modo_ingesta": "stream"}, None),
+             "columnas":    ({"modo_ingesta": "columnas"}, None),
+             "cambios":     ({"modo_escritura": "cambios"}, "fusionar"),
+             "sqlite":      ({"modo_estado": "sqlite"}, "exportar"),
+             "hojas":       ({"modo_escritura": "hojas"}, None),
+             "lectura_paralela": ({"procesos_lectura_censos": 2}, None),
+             "lotes":       ({"donadores_por_lote": 25}, None),
+             "incremental": ({}, "mitades"),
+             "incremental_stream": ({"modo_ingesta": "stream"}, "mitades"),
+             "incremental_hojas": ({"modo_escritura": "hojas"}, "mitades")}
+
+# Cantidad máxima de diferencias de ejemplo en el reporte de cada variante
+ejemplos_por_variante = 10
+
+# Valores iniciales de las variables globales de cada módulo, se restauran
+# antes de cada ejecución
+estado_inicial = {modulo: {llave: deepcopy(valor)
+                           for llave, valor in vars(modulo).items()
+                           if not llave.startswith("__") and
+                           isinstance(valor, (str, int, float, list, dict,
+                                              tuple, type(None)))}
+                  for modulo in (de, original)}
+
+
+###############################################################################
+#                                   CASOS                                     #
+###############################################################################
+def caso_repositorio():
+    """
+    :return: Caso con la encuesta y el libro limpio del repositorio
+             {"nombre", "variables", "archivos": {destino: origen}}
+    """
+    return {"nombre": "repositorio",
+            "variables": {},
+            "archivos": {
+                de.csv_orig_filename:
+                    os.path.join(directorio_repo, de.csv_orig_filename),
+                de.censos_filename:
+                    os.path.join(directorio_repo, censos_limpio_filename)}}
+
+
+def caso_sintetico(directorio, cajas, centros, hojas_por_centro, capacidad,
+                   semilla):
+    """
+    Genera una encuesta y un libro de censos sintéticos en directorio
+
+    :param capacidad: Censos libres por caja solicitada. Con menos de 1.0
+                      parte de las cajas terminan en hoja_error
+
+    :return: Caso con el formato de caso_repositorio
+    """
+    dict_centros = bench.generar_centros(centros, hojas_por_centro)
+    hojas = centros * hojas_por_centro
+    censos_por_hoja = max(1, int(cajas * capacidad / hojas))
+
+    encuesta = os.path.join(directorio, "encuesta.csv")
+    censos = os.path.join(directorio, "censos.xlsx")
+    bench.generar_encuesta(encuesta, cajas, list(dict_centros), semilla)
+    bench.generar_censos(censos, dict_centros, censos_por_hoja)
+
+    return {"nombre": "{} cajas".format(cajas),
+            "variables": {
+                "csv_orig_filename": "encuesta.csv",
+                "censos_filename": "censos.xlsx",
+                "resultados_filename": "censos.xlsx",
+                "encuesta_encoding": "utf-8",
+                "dict_centros_de_acopio": dict_centros,
+                "dict_centros_de_acopio_full_status":
+                    dict.fromkeys(dict_centros, False)},
+            "archivos": {"encuesta.csv": encuesta, "censos.xlsx": censos}}
+
+
+###############################################################################
+#                                 EJECUCIÓN                                   #
+###############################################################################
+def configurar(variables, modulo=de):
+    """
+    Restaura las variables globales de distribuidor_entregas (o de modulo) y
+    aplica las de la ejecución
+    """
+    for llave, valor in estado_inicial[modulo].items():
+        setattr(modulo, llave, deepcopy(valor))
+    for llave, valor in variables.items():
+        if llave not in estado_inicial[modulo]:
+            raise ValueError("Variable global desconocida: {}".format(llave))
+        setattr(modulo, llave, deepcopy(valor))
+
+
+def escribir_mitad(origen, destino):
+    """
+    Copia la primera mitad de los registros de una encuesta .csv
+    """
+    with open(origen, 'rb') as arch_origen:
+        lineas = arch_origen.read().splitlines(keepends=True)
+    with open(destino, 'wb') as arch_destino:
+        arch_destino.write(b''.join(lineas[:len(lineas) // 2]))
+
+
+def ejecutar(caso, directorio, variables, posterior, memoria):
+    """
+    Ejecuta la distribución sobre una copia de las entradas del caso
+
+    :param caso:       Caso con el formato de caso_repositorio
+    :param directorio: Directorio vacío de la ejecución
+    :param variables:  Variables globales de la variante
+    :param posterior:  Paso posterior de la variante (ver variantes)
+    :param memoria:    Si es True se mide el pico de memoria
+
+    :return: Tupla (etapas de Medicion, nombre del libro de resultados)
+    """
+    for destino, origen in caso["archivos"].items():
+        shutil.copy(origen, os.path.join(directorio, destino))
+    configurar(dict(caso["variables"], **variables))
+
+    previo = os.getcwd()
+    os.chdir(directorio)
+    medicion = bench.Medicion(memoria)
+    try:
+        with medicion.etapa("ejecucion"):
+            if posterior == "mitades":
+                escribir_mitad(caso["archivos"][de.csv_orig_filename],
+                               de.csv_orig_filename)
+                de.main()
+                shutil.copy(caso["archivos"][de.csv_orig_filename],
+                            de.csv_orig_filename)
+            de.main()
+            if posterior == "fusionar":
+                de.fusionar_cambios()
+            elif posterior == "exportar":
+                with de.SesionSQLite() as sesion:
+                    sesion.exportar()
+    finally:
+        os.chdir(previo)
+
+    return (medicion.etapas["ejecucion"],
+            os.path.join(directorio, de.resultados_filename))
+
+
+def ejecutar_original(caso, directorio, memoria):
+    """
+    Ejecuta la distribución de referencia con distribuidor_entregas_original
+    sobre una copia de las entradas del caso. Las variables del caso que no
+    existen en la versión original (ej. encuesta_encoding) se omiten. Los
+    contadores que la versión original imprime se descartan para no mezclarlos
+    con el reporte
+
+    :return: Tupla (etapas de Medicion, nombre del libro de resultados)
+    """
+    for destino, origen in caso["archivos"].items():
+        shutil.copy(origen, os.path.join(directorio, destino))
+    configurar({llave: valor for llave, valor in caso["variables"].items()
+                if llave in estado_inicial[original]}, original)
+
+    previo = os.getcwd()
+    os.chdir(directorio)
+    medicion = bench.Medicion(memoria)
+    try:
+        with medicion.etapa("ejecucion"), redirect_stdout(io.StringIO()):
+            original.main()
+    finally:
+        os.chdir(previo)
+
+    return (medicion.etapas["ejecucion"],
+            os.path.join(directorio, original.resultados_filename))
+
+
+###############################################################################
+#                                COMPARACIÓN                                  #
+###############################################################################
+def _sin_vacias(filas):
+    """
+    :return: Lista de filas sin las filas vacías finales
+    """
+    filas = [list(fila) for fila in filas]
+    while filas and all(valor is None for valor in filas[-1]):
+        filas.pop()
+    return filas
+
+
+def leer_resultados(archivo):
+    """
+    Lee las celdas comparadas de un libro de resultados
+
+    :return: Diccionario {hoja: {celda: valor}} con las celdas no vacías
+    """
+    wb = openpyxl.load_workbook(archivo, read_only=True)
+    resultados = {}
+
+    columna = de.indice_columna(de.columna_dueño) + 1
+    for censos in de.dict_centros_de_acopio.values():
+        for censo in censos:
+            filas = _sin_vacias(wb[censo].iter_rows(
+                min_col=columna, max_col=columna, values_only=True))
+            resultados[censo] = {
+                "{}{}".format(de.columna_dueño, fila): valores[0]
+                for fila, valores in enumerate(filas, 1)
+                if valores[0] is not None}
+
+    ancho = de.indice_columna(de.columna_error) + 1
+    filas = _sin_vacias(wb[de.hoja_error].iter_rows(max_col=ancho,
+                                                    values_only=True))
+    resultados[de.hoja_error] = {
+        "{}{}".format(openpyxl.utils.get_column_letter(c), fila): valor
+        for fila, valores in enumerate(filas, 1)
+        for c, valor in enumerate(valores, 1) if valor is not None}
+
+    ws = wb[de.hoja_data_delicada]
+    resultados[de.hoja_data_delicada] = {}
+    for celda in de.lista_celdas:
+        fila = int(celda[1:])
+        columna = de.indice_columna(celda[0]) + 1
+        for valores in ws.iter_rows(min_row=fila, max_row=fila,
+                                    min_col=columna, max_col=columna,
+                                    values_only=True):
+            resultados[de.hoja_data_delicada][celda] = valores[0]
+
+    wb.close()
+    return resultados
+
+
+def diferencias(referencia, resultado):
+    """
+    :return: Lista de diferencias [hoja, celda, valor de referencia, valor
+             del resultado], en el orden de las hojas y celdas
+    """
+    lista = []
+    for hoja in referencia:
+        celdas_ref = referencia[hoja]
+        celdas = resultado.get(hoja, {})
+        for celda in list(celdas_ref) + [celda for celda in celdas
+                                         if celda not in celdas_ref]:
+            if celdas_ref.get(celda) != celdas.get(celda):
+                lista.append([hoja, celda, celdas_ref.get(celda),
+                              celdas.get(celda)])
+    return lista
+
+
+def comparar_caso(caso, directorio, nombres, memoria, dorado):
+    """
+    Ejecuta la referencia y las variantes de un caso y compara sus resultados
+
+    :param nombres: Lista de nombres de variantes a ejecutar
+    :param dorado:  Si es True se compara la referencia con dorado_filename
+
+    :return: Diccionario con las mediciones y diferencias de cada variante
+    """
+    ruta = os.path.join(directorio, "referencia")
+    os.mkdir(ruta)
+    medicion, libro = ejecutar_original(caso, ruta, memoria)
+    # Las hojas a leer dependen de las variables del caso
+    configurar(caso["variables"])
+    referencia = leer_resultados(libro)
+    reporte = {"caso": caso["nombre"],
+               "referencia": medicion,
+               "variantes": {}}
+
+    if dorado:
+        lista = diferencias(referencia, leer_resultados(
+            os.path.join(directorio_repo, dorado_filename)))
+        reporte["dorado"] = {"diferencias": len(lista),
+                             "ejemplos": lista[:ejemplos_por_variante]}
+
+    for nombre in nombres:
+        variables, posterior = variantes[nombre]
+        ruta = os.path.join(directorio, nombre)
+        os.mkdir(ruta)
+        medicion, libro = ejecutar(caso, ruta, variables, posterior, memoria)
+        lista = diferencias(referencia, leer_resultados(libro))
+        reporte["variantes"][nombre] = dict(
+            medicion, diferencias=len(lista),
+            ejemplos=lista[:ejemplos_por_variante])
+        nivel = logging.ERROR if lista else logging.WARNING
+        log.log(nivel, "{}: variante {} con {} diferencias en {:.2f} s".format(
+            caso["nombre"], nombre, len(lista), medicion["segundos"]))
+
+    configurar({})
+    configurar({}, original)
+    return reporte
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Equivalencia de los modos y motores de "
+                    "distribuidor_entregas con la distribución de referencia")
+    parser.add_argument("--cajas", type=int, nargs="+",
+                        help="Casos sintéticos con estas cantidades de cajas. "
+                             "Por defecto se usan los archivos del "
+                             "repositorio")
+    parser.add_argument("--centros", type=int, default=3,
+                        help="Cantidad de centros de acopio sintéticos")
+    parser.add_argument("--hojas-por-centro", type=int, default=2,
+                        help="Cantidad de hojas de censos por centro")
+    parser.add_argument("--capacidad", type=float, default=0.9,
+                        help="Censos libres por caja solicitada en los casos "
+                             "sintéticos")
+    parser.add_argument("--variantes", nargs="+", choices=list(variantes),
+                        default=list(variantes))
+    parser.add_argument("--variables", metavar="JSON",
+                        help="Variante adicional \"personalizada\" con estas "
+                             "variables globales, ej. "
+                             "'{\"motor_asignacion\": \"flujo\"}'")
+    parser.add_argument("--dorado", action="store_true",
+                        help="Compara también la referencia con {}".format(
+                            dorado_filename))
+    parser.add_argument("--sin-memoria", action="store_true",
+                        help="No medir memoria (tracemalloc hace más lenta "
+                             "la ejecución)")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--salida", help="Archivo .json de resultados, por "
+                                         "defecto se imprime en pantalla")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    # Las crisis de los datos se reportan en hoja_error, no en pantalla
+    de.log.setLevel(logging.CRITICAL)
+    original.log.setLevel(logging.CRITICAL)
+
+    nombres = list(args.variantes)
+    if args.variables:
+        variantes["personalizada"] = (json.loads(args.variables), None)
+        nombres.append("personalizada")
+
+    resultados = []
+    for cajas in args.cajas or [None]:
+        with tempfile.TemporaryDirectory() as directorio:
+            if cajas is None:
+                caso = caso_repositorio()
+            else:
+                caso = caso_sintetico(directorio, cajas, args.centros,
+                                      args.hojas_por_centro, args.capacidad,
+                                      args.semilla)
+            log.warning("Caso {}".format(caso["nombre"]))
+            resultados.append(comparar_caso(
+                caso, directorio, nombres, not args.sin_memoria,
+                args.dorado and cajas is None))
+
+    reporte = json.dumps(resultados, indent=2, ensure_ascii=False,
+                         default=str)
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as archivo:
+            archivo.write(reporte)
+    else:
+        print(reporte)
+
+    if any(variante["diferencias"] for resultado in resultados
+           for variante in resultado["variantes"].values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()